@@ -24,6 +24,7 @@
 Conversions between ase and fortran atoms objects
 """
 import inspect
+from collections.abc import MutableMapping
 from copy import deepcopy as cp
 
 import quippy._quippy as _quippy
@@ -337,8 +338,98 @@ def descriptor_data_mono_to_dict(desc_data_mono):
     return out_data_dict
 
 
-def get_dict_arrays(fdict):
-    """Takes the arrays from a quippy dictionary. Copies.
+def descriptor_data_to_dict(desc_data, count, grad=True):
+    """
+    Returns a dictionary of merged arrays out of the first `count` instances of a descriptor_data object.
+
+    Gives the same result as merging `descriptor_data_mono_to_dict()` over all the instances, but the
+    fields are copied into preallocated arrays by the Fortran `descriptor_data_pack*()` routines, so there
+    is a fixed number of wrapper calls instead of one per instance and field. The gradient fields are
+    only taken if grad=True, together with `grad_index_0based`.
+    :param desc_data: descriptor_data object, as returned by the Fortran descriptor calc()
+    :param count: number of descriptor instances to take
+    :param grad: take the gradients as well
+    :return:
+    """
+
+    out_data_dict = dict()
+    if count == 0:
+        return out_data_dict
+
+    n_data, n_ci, n_grad, grad_dim = quippy.descriptor_pack_module.descriptor_data_pack_sizes(desc_data, count)
+
+    has_data = np.zeros(count, dtype=np.int32)
+    covariance_cutoff = np.zeros(count)
+    data = np.zeros(n_data)
+    ci = np.zeros(n_ci, dtype=np.int32)
+    ci_count = np.zeros(count, dtype=np.int32)
+    quippy.descriptor_pack_module.descriptor_data_pack(desc_data, count, has_data, covariance_cutoff, data, ci,
+                                                       ci_count)
+    out_data_dict['has_data'] = has_data.astype(bool)
+    out_data_dict['covariance_cutoff'] = covariance_cutoff
+    out_data_dict['data'] = data
+    out_data_dict['ci'] = ci
+
+    if not grad or grad_dim == 0:
+        return out_data_dict
+
+    grad_count = np.zeros(count, dtype=np.int32)
+    ii = np.zeros(n_grad, dtype=np.int32)
+    has_grad_data = np.zeros(n_grad, dtype=np.int32)
+    pos = np.zeros((3, n_grad), order='F')
+    grad_data = np.zeros((grad_dim, 3, n_grad), order='F')
+    grad_covariance_cutoff = np.zeros((3, n_grad), order='F')
+    quippy.descriptor_pack_module.descriptor_data_pack_grad(desc_data, count, grad_count, ii, has_grad_data, pos,
+                                                            grad_data, grad_covariance_cutoff)
+
+    # per-descriptor arrays, as views of the concatenated ones
+    split = np.cumsum(grad_count)[:-1]
+    out_data_dict['ii'] = np.split(ii, split)
+    out_data_dict['has_grad_data'] = np.split(has_grad_data, split)
+    out_data_dict['pos'] = pos.T
+    out_data_dict['grad_covariance_cutoff'] = grad_covariance_cutoff.T
+    out_data_dict['grad_data'] = np.transpose(grad_data, axes=(2, 1, 0))
+
+    # (descriptor's central atom, atom) for each gradient entry, same as in py2
+    desc_index = np.repeat(np.arange(count), grad_count)
+    out_data_dict['grad_index_0based'] = np.stack([ci[desc_index], ii], axis=1) - 1
+
+    return out_data_dict
+
+
+def get_dict_keys(fdict):
+    """Takes the keys from a quippy dictionary, without touching the values"""
+
+    if not isinstance(fdict, quippy.dictionary_module.Dictionary):
+        raise TypeError('fdict argument is not a quippy.dictionary_module.Dictionary')
+
+    return [fdict.get_key(i).strip().decode('ascii') for i in range(1, fdict.n + 1)]
+
+
+def get_dict_value(fdict, key, copy=True):
+    """Takes a single value from a quippy dictionary.
+
+    Array values are copied, unless copy=False, in which case a view onto the memory owned by the
+    Fortran dictionary is returned. Such a view is only valid while the Fortran object is alive
+    and the entry is neither removed nor resized, so it must not outlive the next modification
+    of the dictionary. Scalar values are always copied."""
+
+    # fixme: fails for non_array elements. Make universal: compatible with array or scalar content in dictionary
+    try:  # this is an unsufficient temporary fix
+        value = f90wrap.runtime.get_array(f90wrap.runtime.sizeof_fortran_t,
+                                          fdict._handle, _quippy.f90wrap_dictionary__array__, key)
+        return value.copy() if copy else value
+    except ValueError:
+        value = fdict.get_value(key)
+        try:
+            # normally it is an tuple, because the error arf from fortran is converted to output
+            return cp(value[0])
+        except TypeError:
+            return cp(value)
+
+
+def get_dict_arrays(fdict, copy=True):
+    """Takes the arrays from a quippy dictionary. Copies, unless copy=False, see `get_dict_value()`.
 
     Probably fails if there are non-array elements in the dictionary"""
 
@@ -346,25 +437,93 @@ def get_dict_arrays(fdict):
         raise TypeError('fdict argument is not a quippy.dictionary_module.Dictionary')
 
     arrays = {}
-    for i in range(1, fdict.n + 1):
-        key = fdict.get_key(i)
-        key = key.strip().decode('ascii')
-        # fixme: fails for non_array elements. Make universal: compatible with array or scalar content in dictionary
-        try:  # this is an unsufficient temporary fix
-            value = f90wrap.runtime.get_array(f90wrap.runtime.sizeof_fortran_t,
-                                              fdict._handle, _quippy.f90wrap_dictionary__array__, key)
-            arrays[key] = value.copy()
-        except ValueError:
-            value = fdict.get_value(key)
-            try:
-                # normally it is an tuple, because the error arf from fortran is converted to output
-                arrays[key] = cp(value[0])
-            except TypeError:
-                arrays[key] = cp(value)
+    for key in get_dict_keys(fdict):
+        arrays[key] = get_dict_value(fdict, key, copy=copy)
 
     return arrays
 
 
+class LazyDictArrays(MutableMapping):
+    """Mapping of the arrays in a quippy dictionary, each pulled from Fortran only when first accessed.
+
+    The keys are read on construction. With copy=False values are views onto the memory owned by the
+    Fortran dictionary, with the lifetime rules of `get_dict_value()`. If given, a reference to `owner`
+    (e.g. the quippy Atoms object holding the dictionary) is kept for as long as the mapping lives, so
+    that the Fortran object is not finalised under the views. Property arrays should be taken with
+    transpose=True, to give them the (N, ...) shape ASE expects.
+
+    Values can be set and deleted like in a normal dict, this does not touch the Fortran dictionary.
+    """
+
+    def __init__(self, fdict, copy=True, transpose=False, exclude=(), owner=None):
+        if not isinstance(fdict, quippy.dictionary_module.Dictionary):
+            raise TypeError('fdict argument is not a quippy.dictionary_module.Dictionary')
+
+        self._fdict = fdict
+        self._owner = owner
+        self._copy = copy
+        self._transpose = transpose
+        self._keys = [key for key in get_dict_keys(fdict) if key not in exclude]
+        self._values = {}
+
+    def __getitem__(self, key):
+        if key not in self._values:
+            if key not in self._keys:
+                raise KeyError(key)
+
+            value = get_dict_value(self._fdict, key, copy=False)
+            if self._transpose and isinstance(value, np.ndarray):
+                value = np.copy(value.T, order='C') if self._copy else value.T
+            elif self._copy and isinstance(value, np.ndarray):
+                value = value.copy()
+            self._values[key] = value
+
+        return self._values[key]
+
+    def __setitem__(self, key, value):
+        if key not in self._keys:
+            self._keys.append(key)
+        self._values[key] = value
+
+    def __delitem__(self, key):
+        self._keys.remove(key)
+        self._values.pop(key, None)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(list(self._keys))
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, self._keys)
+
+
+def get_neighbour_csr(connect, copy=True):
+    """Takes the flat (CSR) neighbour list of a quippy Connection as a dictionary of arrays.
+
+    The neighbours of atom i are entries offsets[i]:offsets[i+1] of 'j' (neighbour indices),
+    'shift' (shape (n, 3)) and 'r_ij', all 0-based, in the same order as the Fortran neighbour()
+    function. The list is only stored if requested, e.g. with at.calc_connect(store_csr=True).
+
+    With copy=False, 'shift' and 'r_ij' are views onto the Fortran arrays, which are only valid
+    until the next calc_connect() or calc_dists(). The indices are always new arrays."""
+
+    if not connect.csr_valid:
+        raise ValueError('Connection has no up to date CSR neighbour list, call calc_connect(store_csr=True) first')
+
+    shift = connect.csr_shift.T
+    r_ij = connect.csr_r_ij
+
+    return {'offsets': np.array(connect.csr_offsets, dtype=int),
+            'j': np.array(connect.csr_j, dtype=int) - 1,
+            'shift': shift.copy() if copy else shift,
+            'r_ij': r_ij.copy() if copy else r_ij}
+
+
 def set_doc(doc, extra):
     def wrap(method):
         method.__doc__ = update_doc_string(doc, extra)
@@ -20,8 +20,17 @@
 # HQ XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX
 
 
+import hashlib
+import itertools
+import json
+import os
+import weakref
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+
 import quippy
 from ase import Atoms
+import ase.io
 import numpy as np
 from ase.io.extxyz import key_val_dict_to_str, key_val_str_to_dict
 from quippy.convert import get_dict_arrays
@@ -41,14 +50,54 @@ def convert_atoms_types_iterable_method(method):
         if isinstance(at, quippy.atoms_types_module.Atoms):
             return method(self, at, *args, **kw)
         elif isinstance(at, Atoms):
-            _quip_at = quippy.convert.ase_to_quip(at,add_arrays=True)
-            return method(self, _quip_at, *args, **kw)
+            return method(self, _get_quip_atoms(at), *args, **kw)
         else:
             return [wrapper(self, atelement, *args, **kw) for atelement in at]
 
     return wrapper
 
 
+# quip Atoms objects converted from ASE Atoms, reused for as long as the ASE object is alive and unchanged,
+# so that several calls (and several descriptors) on the same structure share one conversion and connectivity.
+# Only the most recently used structures are kept, so that looping over a long trajectory does not hold
+# on to the neighbour lists of every frame.
+_QUIP_ATOMS_CACHE_SIZE = 4
+_quip_atoms_cache = OrderedDict()
+
+
+def _atoms_hash(*arrays):
+    """Digest of the content of some numpy arrays, used to detect changes of a structure"""
+    digest = hashlib.blake2b(digest_size=16)
+    for arr in arrays:
+        arr = np.ascontiguousarray(arr)
+        digest.update(str((arr.dtype, arr.shape)).encode())
+        digest.update(arr.data)
+    return digest.digest()
+
+
+def _get_quip_atoms(at):
+    """Returns the quip Atoms object for an ASE Atoms object, only converting it if it has changed"""
+
+    names = sorted(at.arrays.keys())
+    key = (tuple(names), _atoms_hash(at.cell.array, at.pbc, *[at.arrays[name] for name in names]))
+
+    cached = _quip_atoms_cache.get(id(at))
+    if cached is not None and cached[0]() is at and cached[1] == key:
+        _quip_atoms_cache.move_to_end(id(at))
+        return cached[2]
+
+    _quip_at = quippy.convert.ase_to_quip(at, add_arrays=True)
+    if cached is not None:
+        cached[3].detach()
+    _quip_atoms_cache[id(at)] = (weakref.ref(at), key, _quip_at,
+                                 weakref.finalize(at, _quip_atoms_cache.pop, id(at), None))
+    _quip_atoms_cache.move_to_end(id(at))
+    while len(_quip_atoms_cache) > _QUIP_ATOMS_CACHE_SIZE:
+        _, evicted = _quip_atoms_cache.popitem(last=False)
+        evicted[3].detach()
+    return _quip_at
+
+
 class Descriptor:
 
     def __init__(self, args_str=None, **init_kwargs):
@@ -71,6 +120,7 @@ class Descriptor:
             args_str += ' ' + key_val_dict_to_str(init_kwargs)
 
         # intialise the wrapped object and hide it from the user
+        self._args_str = args_str
         self._quip_descriptor = quippy.descriptors_module.descriptor(args_str)
 
         # kept for compatibility with older version
@@ -133,7 +183,9 @@ class Descriptor:
         """
         Internal method for calculating connectivity on a quip_atoms object
 
-        Ideally called only on quip_atoms object, but put in decorator to make sure
+        Ideally called only on quip_atoms object, but put in decorator to make sure.
+        The connectivity is only recalculated if the cutoff, the positions, the cell or
+        the species have changed since the last call on the same object, by any descriptor.
         :param at:
         :return:
         """
@@ -145,8 +197,12 @@ class Descriptor:
             if at.cutoff < self.cutoff() + 1:
                 at.set_cutoff(self.cutoff() + 1)
 
-        # TODO: add logic to skip this if it has been calculated already for speedup
+        key = (at.cutoff, _atoms_hash(at.pos, at.lattice, at.is_periodic, at.z))
+        if getattr(at, '_connect_key', None) == key and at.connect.initialised:
+            return
+
         at.calc_connect()
+        at._connect_key = key
 
     @convert_atoms_types_iterable_method
     def calc_descriptor(self, at, args_str=None, cutoff=None, **calc_kwargs):
@@ -188,43 +244,9 @@ class Descriptor:
         descriptor_out_raw = self._quip_descriptor.calc(at, do_descriptor=True, do_grad_descriptor=grad,
                                                         args_str=args_str)
 
-        # unpack to a list of dicts
-        count = self.count(at, args_str=args_str)
-        descriptor_out = dict()
-        for i in range(count):
-            # unpack to dict with the specific converter function
-            mono_dict = quippy.convert.descriptor_data_mono_to_dict(descriptor_out_raw.x[i])
-
-            # add to the result
-            for key, val in mono_dict.items():
-                if key in descriptor_out.keys():
-                    descriptor_out[key].append(val)
-                else:
-                    descriptor_out[key] = [val]
-
-        # make numpy arrays out of them
-        for key, val in descriptor_out.items():
-            # merge the arrays according to shape
-            if key in ['data', 'ci']:
-                descriptor_out[key] = np.concatenate(val, axis=0)
-            elif key in ['covariance_cutoff', 'has_data']:
-                descriptor_out[key] = np.array(val)
-            elif key in ["pos", "grad_covariance_cutoff"]:
-                # corresponds to the gradients
-                descriptor_out[key] = np.concatenate([x.T for x in val])
-            elif key == "grad_data":
-                descriptor_out[key] = np.transpose(np.concatenate(val, axis=2), axes=(2, 1, 0))
-            elif key == "ii":
-                # copy cross-index into Numpy arrays (f90wrap exposes pointers)
-                descriptor_out[key] = [np.copy(x) for x in val]
-
-        if "ii" in descriptor_out.keys():
-            grad_index_0based = []
-            for idx, ii_perdesc in enumerate(descriptor_out["ii"]):
-                for ii_item in ii_perdesc:
-                    grad_index_0based.append([descriptor_out["ci"][idx], ii_item])
-            # same as in py2, makes iteration of gradient easier
-            descriptor_out["grad_index_0based"] = np.array(grad_index_0based) - 1
+        # unpack to a dict of arrays
+        count = len(descriptor_out_raw.x)
+        descriptor_out = quippy.convert.descriptor_data_to_dict(descriptor_out_raw, count, grad=grad)
 
         if count > 0:
             descriptor_out['data'] = descriptor_out['data'].reshape((count, -1))
@@ -233,3 +255,124 @@ class Descriptor:
 
         # This is a dictionary now and hence needs to be indexed as one, unlike the old version
         return descriptor_out
+
+    def calc_dataset(self, frames, out, n_workers=1, grad=False, chunk_size=100, index=':',
+                     args_str=None, cutoff=None, **calc_kwargs):
+        """
+        Calculates the descriptors of a whole dataset, writing them to disk instead of keeping them in memory.
+
+        The frames are read lazily and cut into chunks of `chunk_size` frames, which are
+        distributed over `n_workers` processes (no process pool for n_workers=1). Each chunk
+        is written as a shard of .npy files into the directory `out`:
+
+        - `data.<shard>.npy`: descriptor values, shape (n_descriptors, n_dim)
+        - `grad_data.<shard>.npy`: gradients, shape (n_gradients, 3, n_dim), if grad=True
+        - `grad_index.<shard>.npy`: `grad_index_0based` of calc() per gradient, if grad=True
+
+        Frame boundaries over the concatenated shards are written to `offsets.npy` (and
+        `grad_offsets.npy`), both of length n_frames + 1, with a summary in `index.json`.
+        Only a few chunks are in flight at any time, so the memory use does not grow with
+        the size of the dataset.
+
+        frames: filename or iterable of ase.atoms.Atoms objects
+            Filenames are read with `ase.io.iread(frames, index=index)`.
+        out: str
+            Output directory, created if it does not exist.
+        Remaining arguments are passed to calc() for every frame.
+
+        Returns the content of `index.json` as a dictionary.
+        """
+
+        if isinstance(frames, str):
+            frames = ase.io.iread(frames, index=index)
+        frames = iter(frames)
+
+        if args_str is None:
+            args_str = key_val_dict_to_str(calc_kwargs)
+        else:
+            args_str += ' ' + key_val_dict_to_str(calc_kwargs)
+
+        os.makedirs(out, exist_ok=True)
+        chunks = iter(lambda: list(itertools.islice(frames, chunk_size)), [])
+        tasks = ((self._args_str, out, i_shard, chunk, grad, args_str, cutoff)
+                 for i_shard, chunk in enumerate(chunks))
+
+        if n_workers > 1:
+            with ProcessPoolExecutor(n_workers) as executor:
+                # keep a bounded number of chunks in flight, in order
+                pending = deque()
+                shards = []
+                for task in tasks:
+                    pending.append(executor.submit(_calc_dataset_shard, *task))
+                    if len(pending) >= 2 * n_workers:
+                        shards.append(pending.popleft().result())
+                shards.extend(future.result() for future in pending)
+        else:
+            shards = [_calc_dataset_shard(*task) for task in tasks]
+
+        first_frame = 0
+        for shard in shards:
+            shard['first_frame'] = first_frame
+            first_frame += shard['n_frames']
+
+        offsets = np.cumsum([0] + [n for shard in shards for n in shard.pop('n_descriptors')])
+        np.save(os.path.join(out, 'offsets.npy'), offsets)
+        if grad:
+            grad_offsets = np.cumsum([0] + [n for shard in shards for n in shard.pop('n_gradients')])
+            np.save(os.path.join(out, 'grad_offsets.npy'), grad_offsets)
+
+        index = {'descriptor': self._args_str, 'args_str': args_str, 'n_dim': self.n_dim, 'grad': grad,
+                 'n_frames': len(offsets) - 1, 'n_descriptors': int(offsets[-1]), 'shards': shards}
+        with open(os.path.join(out, 'index.json'), 'w') as f:
+            json.dump(index, f, indent=1)
+
+        return index
+
+
+# descriptors used by the dataset workers, initialised once per process
+_dataset_descriptors = {}
+
+
+def _calc_dataset_shard(descriptor_args_str, out, i_shard, frames, grad, args_str, cutoff):
+    """Calculates the descriptors of one chunk of frames for `Descriptor.calc_dataset()` and writes the shard"""
+
+    if descriptor_args_str not in _dataset_descriptors:
+        _dataset_descriptors[descriptor_args_str] = Descriptor(descriptor_args_str)
+    desc = _dataset_descriptors[descriptor_args_str]
+
+    results = [desc.calc(at, grad=grad, args_str=args_str, cutoff=cutoff) for at in frames]
+    n_descriptors = [res['data'].shape[0] if res['data'].size else 0 for res in results]
+
+    shard = {'n_frames': len(frames), 'n_descriptors': n_descriptors}
+    names = {'data': 'data.{:06d}.npy'.format(i_shard)}
+    if grad:
+        shard['n_gradients'] = [len(res.get('grad_index_0based', ())) for res in results]
+        names['grad_data'] = 'grad_data.{:06d}.npy'.format(i_shard)
+        names['grad_index'] = 'grad_index.{:06d}.npy'.format(i_shard)
+
+    # fill preallocated files frame by frame, rather than concatenating in memory
+    data = np.lib.format.open_memmap(os.path.join(out, names['data']), mode='w+', dtype=float,
+                                     shape=(sum(n_descriptors), desc.n_dim))
+    if grad:
+        n_gradients = sum(shard['n_gradients'])
+        grad_data = np.lib.format.open_memmap(os.path.join(out, names['grad_data']), mode='w+', dtype=float,
+                                              shape=(n_gradients, 3, desc.n_dim))
+        grad_index = np.lib.format.open_memmap(os.path.join(out, names['grad_index']), mode='w+', dtype=np.int64,
+                                               shape=(n_gradients, 2))
+
+    i_desc = i_grad = 0
+    for i, res in enumerate(results):
+        if n_descriptors[i] > 0:
+            data[i_desc:i_desc + n_descriptors[i]] = res['data']
+            i_desc += n_descriptors[i]
+        if grad and shard['n_gradients'][i] > 0:
+            grad_data[i_grad:i_grad + shard['n_gradients'][i]] = res['grad_data']
+            grad_index[i_grad:i_grad + shard['n_gradients'][i]] = res['grad_index_0based']
+            i_grad += shard['n_gradients'][i]
+
+    del data
+    if grad:
+        del grad_data, grad_index
+
+    shard.update(names)
+    return shard
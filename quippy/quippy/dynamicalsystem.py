@@ -19,6 +19,9 @@
 # HQ X
 # HQ XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX
 
+import queue
+import sys
+import threading
 import warnings
 from math import sqrt
 
@@ -27,6 +30,7 @@ import numpy as np
 from quippy import dynamicalsystem_module
 import quippy.convert
 import quippy.atoms_types_module
+import quippy.potential
 
 import quippy._quippy as _quippy
 
@@ -43,7 +47,9 @@ MASSCONVERT = 103.6426957074462
 # from quippy.system import InOutput, OUTPUT
 
 import ase.io
+import ase.io.extxyz
 import ase.md
+from ase.data import atomic_masses
 from ase.io.trajectory import Trajectory
 from ase.optimize import optimize
 
@@ -87,7 +93,173 @@ _barostat_types = {
     'BAROSTAT_HOOVER_LANGEVIN': 1,
 }
 
-__all__ = ['Dynamics', 'DynamicalSystem']
+__all__ = ['Dynamics', 'DynamicalSystem', 'AsyncTrajectoryWriter', 'AsyncLogWriter']
+
+
+class _AsyncWriter:
+    """
+    Base class of writers doing their output from a background thread
+
+    Items are passed to the thread through a bounded queue, so a producer that
+    is faster than the output blocks instead of accumulating items in memory.
+    Errors in the thread are raised again on the next call from the producer.
+    """
+
+    def __init__(self, maxsize):
+        self._queue = queue.Queue(maxsize)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                if self._error is None:
+                    self._write(item)
+            except Exception as err:
+                self._error = err
+            finally:
+                self._queue.task_done()
+
+    def _write(self, item):
+        raise NotImplementedError
+
+    def _close(self):
+        pass
+
+    def _check(self):
+        if self._error is not None:
+            err, self._error = self._error, None
+            raise err
+
+    def _put(self, item):
+        self._check()
+        if not self._thread.is_alive():
+            raise ValueError('writer is closed')
+        self._queue.put(item)
+
+    def flush(self):
+        """Wait until everything queued so far has been written"""
+        self._queue.join()
+        self._check()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+            self._close()
+        self._check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class AsyncTrajectoryWriter(_AsyncWriter):
+    """
+    Trajectory writer doing the file output from a background thread
+
+    write() only takes a snapshot of the positions, momenta, cell and the
+    arrays listed in `properties`; formatting and file output are done by
+    the thread. The wrapped Fortran calls hold the GIL, so the output does not
+    overlap with force evaluations done through them, only with Python code
+    and waits on the file system. At most `maxsize` frames are queued.
+
+    :param filename: output file name
+    :param format: ``"extxyz"`` or ``"netcdf"`` (AMBER convention, written
+                   with :class:`ase.io.netcdftrajectory.NetCDFTrajectory`).
+                   Defaults to netcdf for the ``.nc`` extension, extxyz otherwise.
+    :param properties: names of additional per-atom arrays to write
+    :param maxsize: maximum number of queued frames
+    """
+
+    def __init__(self, filename, format=None, properties=None, maxsize=16):
+        if format is None:
+            format = 'netcdf' if filename.endswith('.nc') else 'extxyz'
+        if format == 'extxyz':
+            self._file = open(filename, 'w')
+        elif format == 'netcdf':
+            from ase.io.netcdftrajectory import NetCDFTrajectory
+            self._file = NetCDFTrajectory(filename, 'w')
+        else:
+            raise ValueError('unsupported trajectory format: {}'.format(format))
+
+        self.format = format
+        self.properties = list(properties) if properties is not None else []
+        _AsyncWriter.__init__(self, maxsize)
+
+    def write(self, atoms, **info):
+        """
+        Queue a frame of `atoms` (ASE or quippy Atoms), with `info` added to atoms.info
+        """
+        if isinstance(atoms, quippy.atoms_types_module.Atoms):
+            snapshot = {'numbers': atoms.z.copy(), 'positions': atoms.pos.T.copy(),
+                        'cell': atoms.lattice.T.copy(), 'pbc': atoms.is_periodic.astype(bool),
+                        'arrays': {name: np.copy(quippy.convert.get_dict_value(atoms.properties, name, copy=False).T)
+                                   for name in self.properties}}
+            keys = quippy.convert.get_dict_keys(atoms.properties)
+            if 'velo' in keys:
+                masses = atoms.mass / MASSCONVERT if 'mass' in keys else atomic_masses[atoms.z]
+                snapshot['arrays']['momenta'] = masses[:, np.newaxis] * \
+                                                quippy.convert.velocities_quip_to_ase(atoms.velo)
+        else:
+            snapshot = {'numbers': atoms.numbers.copy(), 'positions': atoms.positions.copy(),
+                        'cell': atoms.cell.array.copy(), 'pbc': atoms.pbc.copy(),
+                        'arrays': {name: atoms.arrays[name].copy() for name in self.properties}}
+            if atoms.has('momenta'):
+                snapshot['arrays']['momenta'] = atoms.arrays['momenta'].copy()
+        snapshot['info'] = info
+        self._put(snapshot)
+
+    def _write(self, snapshot):
+        atoms = ase.Atoms(numbers=snapshot['numbers'], positions=snapshot['positions'],
+                          cell=snapshot['cell'], pbc=snapshot['pbc'])
+        for name, value in snapshot['arrays'].items():
+            atoms.arrays[name] = value
+        atoms.info.update(snapshot['info'])
+
+        if self.format == 'extxyz':
+            ase.io.extxyz.write_extxyz(self._file, atoms)
+        else:
+            self._file.write(atoms)
+
+    def _close(self):
+        self._file.close()
+
+
+class AsyncLogWriter(_AsyncWriter):
+    """
+    Writer of log lines from a background thread
+
+    :param logfile: file name, open file object, or ``"-"`` for stdout
+    :param maxsize: maximum number of queued lines
+    """
+
+    def __init__(self, logfile='-', maxsize=64):
+        if logfile == '-':
+            self._file, self._own_file = sys.stdout, False
+        elif isinstance(logfile, str):
+            self._file, self._own_file = open(logfile, 'w'), True
+        else:
+            self._file, self._own_file = logfile, False
+        _AsyncWriter.__init__(self, maxsize)
+
+    def write(self, line):
+        self._put(line)
+
+    def _write(self, line):
+        self._file.write(line + '\n')
+
+    def _close(self):
+        if self._own_file:
+            self._file.close()
+        else:
+            self._file.flush()
 
 
 class DynamicalSystem(dynamicalsystem_module.DynamicalSystem):
@@ -104,6 +276,23 @@ class DynamicalSystem(dynamicalsystem_module.DynamicalSystem):
     #                                                     restraints=restraints, rigidbodies=rigidbodies, error=error,
     #                                                     handle=handle)
 
+    def _own_atoms(self, atoms):
+        """
+        Take over the finalisation of the quip `atoms` this DynamicalSystem was initialised with
+
+        The Fortran DynamicalSystem points to the atoms, so they must be finalised after it. The
+        garbage collector may call the finalisers of the two wrappers in any order, e.g. when
+        both are only referenced from a reference cycle, so the atoms are finalised from here.
+        """
+        self._owned_atoms = atoms
+        atoms._alloc = False
+
+    def __del__(self):
+        dynamicalsystem_module.DynamicalSystem.__del__(self)
+        atoms = self.__dict__.pop('_owned_atoms', None)
+        if atoms is not None:
+            _quippy.f90wrap_atoms_finalise(this=atoms._handle)
+
     def run(self, pot, dt, n_steps, summary_interval=None, hook_interval=None, write_interval=None,
             trajectory=None, args_str=None, hook=None,
             save_interval=None):
@@ -112,14 +301,29 @@ class DynamicalSystem(dynamicalsystem_module.DynamicalSystem):
             raise ValueError('hook_interval not permitted when hook is not present')
 
         if hook is None:
-            traj = []
-            save_hook = lambda: traj.append(self.atoms.copy())
-            dynamicalsystem_module.DynamicalSystem.run(self, pot, dt, n_steps,
-                                                       save_hook, hook_interval=save_interval,
-                                                       summary_interval=summary_interval,
-                                                       write_interval=write_interval,
-                                                       trajectory=trajectory,
-                                                       args_str=args_str)
+            traj = writer = None
+            own_writer = isinstance(trajectory, str)
+            if isinstance(trajectory, (str, AsyncTrajectoryWriter)):
+                # frames are written from a background thread instead of being kept in memory
+                writer = AsyncTrajectoryWriter(trajectory) if isinstance(trajectory, str) else trajectory
+                save_hook = lambda: writer.write(self.atoms)
+                trajectory = None
+            else:
+                traj = []
+                save_hook = lambda: traj.append(self.atoms.copy())
+            try:
+                dynamicalsystem_module.DynamicalSystem.run(self, pot, dt, n_steps,
+                                                           save_hook, hook_interval=save_interval,
+                                                           summary_interval=summary_interval,
+                                                           write_interval=write_interval,
+                                                           trajectory=trajectory,
+                                                           args_str=args_str)
+            finally:
+                # also when the run fails, so that the writer thread does not outlive it
+                if own_writer:
+                    writer.close()
+                elif writer is not None:
+                    writer.flush()
             return traj
         else:
             dynamicalsystem_module.DynamicalSystem.run(self, pot, dt, n_steps, hook, hook_interval=hook_interval,
@@ -146,22 +350,29 @@ class Dynamics(optimize.Dynamics):
                     to convert from femtoseconds)
 
     :param trajectory: output file to which to write the trajectory.
-                      Can be a string to create a new output object.
+                      Can be a string to create a new
+                      :class:`AsyncTrajectoryWriter` (extxyz, or NetCDF for
+                      ``.nc`` files), or an existing writer. Frames are
+                      written from a background thread.
 
     :param trajectoryinterval: interval at which to write frames
 
     :param initialtemperature: if not ``None``, rescale initial velocities
                               to a specified temperature, given in K.
 
-    :param logfile: filename or open InOutput object to write log lines to.
-              Use special filename ``"-"`` for stdout (default).
+    :param logfile: filename or open file object to write log lines to.
+              Use special filename ``"-"`` for stdout (default). Lines are
+              written from a background thread.
 
-    :param loginterval: interval at which to write log lines
+    :param loginterval: interval at which to write log lines, defaults to
+              `trajectoryinterval`. Native runs (see :meth:`run`) are done in
+              blocks between observer calls, so a short interval makes them
+              slower.
     """
 
     def __init__(self, atoms, timestep, trajectory,
                  trajectoryinterval=10, initialtemperature=None,
-                 logfile='-', loginterval=1, loglabel='D'):
+                 logfile='-', loginterval=None, loglabel='D'):
 
         # check for type first
         if not isinstance(atoms, ase.Atoms):
@@ -180,9 +391,10 @@ class Dynamics(optimize.Dynamics):
 
         # initialise accelerations as zero, so that we have the objects in QUIP
         _quippy.f90wrap_atoms_add_property_real_2da(this=self._quip_atoms._handle, name='acc',
-                                                    value=np.zeros((len(atoms), 3)))
+                                                    value=np.zeros((3, len(atoms))))
 
         self._ds = DynamicalSystem(self._quip_atoms)
+        self._ds._own_atoms(self._quip_atoms)
 
         # checking initial temperature and velocities
         if initialtemperature is not None:
@@ -198,24 +410,20 @@ class Dynamics(optimize.Dynamics):
         self.observers = []
         self.set_timestep(timestep)
 
+        self._trajectory = None
+        self._own_trajectory = isinstance(trajectory, str)
         if trajectory is not None:
-            # fixme: this is not been worked on yet
-            # # We also want to save the positions of all atoms after every 100th time step. --- ASE DOCS
-            # traj = Trajectory('moldyn3.traj', 'w', atoms)
-            # dyn.attach(traj.write, interval=50)
+            if isinstance(trajectory, str):
+                trajectory = AsyncTrajectoryWriter(trajectory)
+            self._trajectory = trajectory
+            self.attach(self.write_trajectory, trajectoryinterval)
 
-            # if isinstance(trajectory, str):
-            #     trajectory = AtomsWriter(trajectory)
-            # self.attach(trajectory, trajectoryinterval, self._ds.atoms)
-            raise NotImplementedError
-
-        # fixme: this is not been worked on yet
         self.loglabel = loglabel
+        self._logfile = None
         if logfile is not None:
-            # if isinstance(logfile, str):
-            #     logfile = InOutput(logfile, OUTPUT)
-            # self.attach(self.print_status, loginterval, logfile)
-            raise NotImplementedError
+            self._logfile = AsyncLogWriter(logfile)
+            self._log_header = True
+            self.attach(self.write_log, loginterval if loginterval is not None else trajectoryinterval)
 
         # fixme: this is not been worked on yet
         self._calc_virial = False
@@ -361,33 +569,125 @@ class Dynamics(optimize.Dynamics):
 
         # Copy status into atoms.params
         # TODO: this would nee to go to the new observer, rigth?
-        self._quip_atoms.params['time'] = self._ds.t * fs  # from fs to ASE time units
-        self._quip_atoms.params['nsteps'] = self._ds.nsteps
-        self._quip_atoms.params['cur_temp'] = self._ds.cur_temp
-        self._quip_atoms.params['avg_temp'] = self._ds.avg_temp
-        self._quip_atoms.params['dW'] = self._ds.dw
-        self._quip_atoms.params['work'] = self._ds.work
-        self._quip_atoms.params['Epot'] = self._ds.epot
-        self._quip_atoms.params['Ekin'] = self._ds.ekin
-        self._quip_atoms.params['Wkin'] = self._ds.wkin
-        self._quip_atoms.params['thermostat_dW'] = self._ds.thermostat_dw
-        self._quip_atoms.params['thermostat_work'] = self._ds.thermostat_work
+        self._update_params()
 
         # return f(t+dt)
         return forces
 
-    def run(self, steps=50):
+    def _update_params(self):
+        """
+        Copy the status of the dynamical system into the params of the quip atoms
+        """
+        params = self._quip_atoms.params._handle
+        _quippy.f90wrap_dictionary_set_value_r(this=params, key='time', value=self._ds.t * fs)  # to ASE time units
+        _quippy.f90wrap_dictionary_set_value_i(this=params, key='nsteps', value=self._ds.nsteps)
+        for key, value in [('cur_temp', self._ds.cur_temp), ('avg_temp', self._ds.avg_temp),
+                           ('dW', self._ds.dw), ('work', self._ds.work),
+                           ('Epot', self._ds.epot), ('Ekin', self._ds.ekin), ('Wkin', self._ds.wkin),
+                           ('thermostat_dW', self._ds.thermostat_dw),
+                           ('thermostat_work', self._ds.thermostat_work)]:
+            _quippy.f90wrap_dictionary_set_value_r(this=params, key=key, value=value)
+
+    def _sync_to_ase(self, masses):
+        """
+        Copy positions and momenta from the quip atoms to the ASE atoms, bypassing constraints
+        """
+        self.ase_atoms.arrays['positions'] = self._quip_atoms.pos.T.copy()
+        self.ase_atoms.arrays['momenta'] = masses * quippy.convert.velocities_quip_to_ase(self._quip_atoms.velo)
+
+    def run(self, steps=50, native=True):
         """
         Run dynamics forwards for `steps` steps.
+
+        If `native` is True and the system allows it, i.e. the calculator is a
+        quippy Potential, there are no ASE constraints and no virial is needed
+        for a barostat, the steps are done in Fortran with the wrapped Fortran
+        potential, in blocks up to the next step at which an observer is due.
+        The ASE atoms are only updated before the observers are called and at
+        the end of the run.
         """
-        f = self._quip_atoms.get_forces()
-        for step in range(steps):
-            f = self.step(f)
+        if native and self._can_run_native():
+            self._run_native(steps)
+        else:
+            f = self.ase_atoms.get_forces()
+            for step in range(steps):
+                f = self.step(f)
+                self.call_observers()
+
+        self.flush()
+
+    def _can_run_native(self):
+        return (isinstance(self.ase_atoms.calc, quippy.potential.Potential) and
+                not self.ase_atoms.constraints and not self._calc_virial)
+
+    def _run_native(self, steps):
+        calc = self.ase_atoms.calc
+        masses = self.ase_atoms.get_masses()[:, np.newaxis]
+        if calc.cutoff_skin == 'auto':
+            self._quip_atoms.connect.auto_skin = True
+        elif calc.cutoff_skin:
+            self._quip_atoms.cutoff_skin = calc.cutoff_skin
+
+        if self._ds.nsteps == 0:
+            # set initial accelerations a(t), same as in step()
+            self._quip_atoms.acc[:] = self.ase_atoms.get_forces().T / self._quip_atoms.mass
+
+        intervals = [interval for _, interval, _, _ in self.observers if interval > 0]
+        last_step = self._ds.nsteps + steps
+        while self._ds.nsteps < last_step:
+            # advance up to the next step at which any of the observers is due
+            n_steps = last_step - self._ds.nsteps
+            for interval in intervals:
+                n_steps = min(n_steps, interval - self._ds.nsteps % interval)
+            self._ds.run_steps(calc._quip_potential, self._dt, n_steps, args_str=calc.calc_args)
+
+            self._sync_to_ase(masses)
+            self._update_params()
             self.call_observers()
 
     def print_status(self, file=None):
         self._ds.print_status(self.loglabel, file=file)
 
+    def write_trajectory(self):
+        """
+        Queue the current frame for writing to the trajectory
+        """
+        self._trajectory.write(self.ase_atoms, time=self.get_time(), nsteps=self.nsteps,
+                               cur_temp=self._ds.cur_temp, avg_temp=self._ds.avg_temp)
+
+    def write_log(self):
+        """
+        Queue a status line for the log, with the same columns as print_status()
+        """
+        if self._log_header:
+            self._logfile.write('{}{:>12s}{:>12s}{:>12s}{:>12s}{:>20s}{:>20s}'.format(
+                ' ' * len(self.loglabel), 'Time', 'Temp', 'Mean temp', 'Norm(p)', 'Total work', 'Thermo work'))
+            self._log_header = False
+        momentum = np.sum(self._quip_atoms.mass * self._quip_atoms.velo, axis=1)
+        self._logfile.write('{}{:12.2f}{:12.4f}{:12.4f}{:12.2e}{:20.8e}{:20.8e}'.format(
+            self.loglabel, self._ds.t, self._ds.cur_temp, self._ds.avg_temp, np.linalg.norm(momentum),
+            self._ds.work, self._ds.thermostat_work))
+
+    def flush(self):
+        """
+        Wait until the queued trajectory frames and log lines have been written
+        """
+        for writer in [self._trajectory, self._logfile]:
+            if writer is not None:
+                writer.flush()
+
+    def close(self):
+        """
+        Finish writing and close the log and the trajectory, if it was opened by this object
+        """
+        if self._logfile is not None:
+            self._logfile.close()
+        if self._trajectory is not None:
+            if self._own_trajectory:
+                self._trajectory.close()
+            else:
+                self._trajectory.flush()
+
     def set_time(self, time):
         self._ds.t = time / fs
 
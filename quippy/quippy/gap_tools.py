@@ -2,14 +2,17 @@ import numpy as np
 from xml.etree.ElementTree import parse, fromstring, tostring, ElementTree
 import re
 import os
+from copy import copy
 from quippy.descriptors import Descriptor
 from quippy.potential import Potential
 from ase.data import chemical_symbols
 
 try: # Try to use triangular solve (faster), if available
     from scipy.linalg import solve_triangular as solve
+    _have_triangular_solve = True
 except ImportError: # Revert to general solve
     solve = np.linalg.solve
+    _have_triangular_solve = False
 
 
 
@@ -26,6 +29,7 @@ class DescXMLWrapper():
     self.cov_type : Covariance kernel string
     self.desc_type : Name of descriptor function
     self.name : Useful name for the descriptor
+    self.sparseX_filename : Name of the file holding the sparse points, relative to the XML file
 
 
     '''
@@ -45,11 +49,15 @@ class DescXMLWrapper():
         self.nsparse = self.weights.shape[0]
 
         self.delta = float(desc_xml.attrib["signal_variance"])
+        self.signal_mean = float(desc_xml.attrib.get("signal_mean", 0.0))
+        self.n_permutations = int(desc_xml.attrib.get("n_permutations", 1))
+        self.sparseX_filename = desc_xml.attrib.get("sparseX_filename")
         self._int_cov_type = int(desc_xml.attrib["covariance_type"])
 
         if self._int_cov_type == 1:  # ard_se
-            self.cov_prop = float([child.text.split()[0]
-                                  for child in desc_xml if "theta" in child.tag][0])
+            self.theta = np.array([child.text.split()
+                                  for child in desc_xml if "theta" in child.tag][0], dtype=float)
+            self.cov_prop = self.theta[0]
             self.cov_type = "ard_se"
         elif self._int_cov_type == 2:  # dot_product
             self.cov_prop = float(desc_xml.attrib["zeta"])
@@ -74,6 +82,59 @@ class DescXMLWrapper():
 
         self.quip_desc = Descriptor(self._cmd)
 
+        self._sparse_X = None
+
+    def sparse_X(self, xml_dir):
+        '''
+        Sparse points of the descriptor GP, shape (nsparse, n_dim), read from the sparseX file in xml_dir
+        The file is only read on first use
+        '''
+        if self._sparse_X is None:
+            if self.sparseX_filename is None:
+                raise FileNotFoundError(f"No sparseX file given for descriptor {self.name}")
+            self._sparse_X = np.loadtxt(os.path.join(xml_dir, self.sparseX_filename)).reshape((self.nsparse, -1))
+
+        return self._sparse_X
+
+    def predict(self, X, sparse_X, weights, grad=False):
+        '''
+        Local GP predictions for descriptor vectors X (n_desc, n_dim) against the sparse points, for all
+        columns of weights (nsparse, N) at once. The kernel vector of each descriptor is only computed once.
+
+        Returns the predictions, shape (n_desc, N), and if grad=True also their derivatives with respect
+        to the descriptor vectors, shape (n_desc, N, n_dim)
+        '''
+        if self.n_permutations != 1:
+            raise NotImplementedError(f"Descriptor {self.name} has permutational symmetry, which is not supported")
+
+        if self.cov_type == "ard_se":
+            X_theta = X / self.theta
+            S_theta = sparse_X / self.theta
+            sq_dist = (np.sum(X_theta**2, axis=1)[:, None] + np.sum(S_theta**2, axis=1)[None, :]
+                       - 2.0 * X_theta @ S_theta.T)
+            K = self.delta**2 * np.exp(-0.5 * np.maximum(sq_dist, 0.0)) * self.sparse_cuts
+            # d K[i, s] / d X[i] = K[i, s] * (sparse_X[s] - X[i]) / theta**2
+            dK = K
+        elif self.cov_type == "dot_product":
+            XS = X @ sparse_X.T
+            K = self.delta**2 * XS**self.cov_prop * self.sparse_cuts
+            # d K[i, s] / d X[i] = dK[i, s] * sparse_X[s]
+            dK = self.delta**2 * self.cov_prop * XS**(self.cov_prop - 1) * self.sparse_cuts
+        else:
+            raise NotImplementedError(f"Covariance type {self.cov_type} of descriptor {self.name} is not supported")
+
+        pred = K @ weights + self.signal_mean
+
+        if not grad:
+            return pred
+
+        # one (n_desc x nsparse) @ (nsparse x n_dim) product per committee member
+        pred_grad = np.stack([(dK * w) @ sparse_X for w in weights.T], axis=1)
+        if self.cov_type == "ard_se":
+            pred_grad = (pred_grad - (K @ weights)[:, :, None] * X[:, None, :]) / self.theta**2
+
+        return pred, pred_grad
+
 
 class GAPXMLWrapper():
     '''
@@ -92,6 +153,8 @@ class GAPXMLWrapper():
     self.save(fname) : Save the xml data back to an xml file
     self.as_potential() : Return the equivalent quippy.potential.Potential
     self.draw_posterior_sample(num_samples) : Draw samples from the posterior, if available
+    self.draw_posterior_weights(num_samples) : Draw weights from the posterior, without building new models
+    self.as_committee(weights) : Return a GAPCommittee evaluating the model for several sets of weights at once
     '''
 
     def __init__(self, xml, mean_weights=None, xml_dir=None):
@@ -130,6 +193,11 @@ class GAPXMLWrapper():
         else:
             self.mean_weights = self.weights.copy()
 
+        self.R = None
+        self._R_triangle = None
+        self._template = None
+        self._alpha_elements = None
+
     def save(self, fname):
         '''
         Save internal XML tree to fname
@@ -144,6 +212,7 @@ class GAPXMLWrapper():
             dest_dir = file_dir
 
         # Save XML file
+        self._write_weights()
         with open(fname, "wb") as f:
             self._xml_tree.write(f)
 
@@ -166,7 +235,8 @@ class GAPXMLWrapper():
 
         try:
             os.chdir(self.xml_dir) # Change to same dir as the xml, so QUIP can find sparseX files
-            
+
+            self._write_weights()
             pot = Potential(param_str=tostring(self._xml_tree.getroot()))
             pot.xml = self
 
@@ -178,58 +248,263 @@ class GAPXMLWrapper():
 
         return pot
 
-    def _posterior_sample(self):
-        if self.R is not None:
-            z = np.random.normal(size=self.total_nsparse)
+    def core_potential(self):
+        '''
+        Return quippy.potential.Potential for the non-GAP (core) part of the model, or None for a pure GAP model
+        '''
+        root = self._xml_tree.getroot()
+        init_args = root[0].attrib["init_args"]
 
-            return self.mean_weights + np.linalg.solve(self.R, z)
-        else:
-            raise FileNotFoundError(f"R matrix not found in directory {self.xml_dir}.")
+        if init_args.split()[:2] == ["IP", "GAP"]:
+            return None
+
+        pot_args = re.findall(r"init_args_pot\d\s*=\s*\{([^}]*)\}", init_args)
+        core_args = [args for args in pot_args if args.split()[:2] != ["IP", "GAP"]]
 
-    def _xml_sample(self):
-        new_weights = self._posterior_sample()
+        if init_args.split()[0] != "Sum" or len(core_args) != 1:
+            raise NotImplementedError(f"Cannot separate the core potential from the GAP model in '{init_args}'")
 
-        new_root = fromstring(tostring(self._xml_tree.getroot()))
+        return Potential(init_args=core_args[0], param_str=tostring(root))
 
-        new_tree = ElementTree(new_root)
+    def as_committee(self, weights):
+        '''
+        Return GAPCommittee evaluating this model for each column of weights (total_nsparse, committee_size)
+        '''
+        return GAPCommittee(self, weights)
 
-        new_descs = new_root[1][1][:]
+    def _posterior_sample(self):
+        return self.draw_posterior_weights()[:, 0]
 
-        isparse = 0
+    def _sample_template(self):
+        # Copy of the XML tree without XYZ data, shared by all samples drawn from this model, and its
+        # sparseX elements in the order of self.weights. Samples only write their alphas into it when saved
+        if self._template is None:
+            new_root = fromstring(tostring(self._xml_tree.getroot()))
 
-        for i in range(self.num_desc):
+            XYZ_data = [child for child in new_root[1] if child.tag == "XYZ_data"]
 
-            desc_nsparse = self.descriptors[i].nsparse
+            if len(XYZ_data):  # Parent xml has XYZ data
+                for dat in XYZ_data:
+                    new_root[1].remove(dat)
 
-            desc_wts = [child for child in new_descs[i]
-                        if "sparseX" in child.tag]
+            alpha_elements = [child for desc_xml in new_root[1][1][:]
+                              for child in desc_xml if "sparseX" in child.tag]
 
-            for j in range(desc_nsparse):
-                desc_wts[j].attrib["alpha"] = str(new_weights[isparse])
-                isparse += 1
+            self._template = (ElementTree(new_root), alpha_elements)
 
-        XYZ_data = [child for child in new_root[1] if child.tag == "XYZ_data"]
+        return self._template
 
-        if len(XYZ_data):  # Parent xml has XYZ data
-            for dat in XYZ_data:
-                new_root[1].remove(dat)
+    def _write_weights(self):
+        # Write own weights into the (shared) XML tree, for models drawn by draw_posterior_samples()
+        if self._alpha_elements is not None:
+            for element, weight in zip(self._alpha_elements, self.weights):
+                element.attrib["alpha"] = str(weight)
 
-        return new_tree
+    def _with_weights(self, weights):
+        new = copy(self)
+        new.weights = weights
+        new._xml_tree, new._alpha_elements = self._sample_template()
+
+        new.descriptors = []
+        isparse = 0
+        for desc in self.descriptors:
+            new_desc = copy(desc)
+            new_desc.weights = weights[isparse:isparse + desc.nsparse]
+            new.descriptors.append(new_desc)
+            isparse += desc.nsparse
+
+        return new
 
     def draw_posterior_samples(self, num_samples=1):
         '''
         Draw samples from the posterior of the GAP model
         Only possible if <GAP_fname>.R.<GAP_label> exists in the same dir as the GAP XML file
         '''
+        samples = [self._with_weights(weights) for weights in self.draw_posterior_weights(num_samples).T]
+
         if num_samples == 1:
-            return GAPXMLWrapper(self._xml_sample(), mean_weights=self.mean_weights, xml_dir=self.xml_dir)
+            return samples[0]
+        else:
+            return samples
+
+    def draw_posterior_weights(self, num_samples=1):
+        '''
+        Draw weights from the posterior of the GAP model, as an array of shape (total_nsparse, num_samples)
+        All samples are drawn with a single solve against R
+        Only possible if <GAP_fname>.R.<GAP_label> exists in the same dir as the GAP XML file
+        '''
+        if self.R is None:
+            raise FileNotFoundError(f"R matrix not found in directory {self.xml_dir}.")
+
+        # same random numbers per sample as drawing the samples one by one
+        z = np.random.normal(size=(num_samples, self.total_nsparse)).T
+
+        if self._R_triangle is None:
+            self._R_triangle = _triangle(self.R)
+
+        if _have_triangular_solve and self._R_triangle != "full":
+            dw = solve(self.R, z, lower=self._R_triangle == "lower", check_finite=False)
         else:
-            return [self.draw_posterior_samples() for i in range(num_samples)]
+            dw = np.linalg.solve(self.R, z)
 
+        return self.mean_weights[:, np.newaxis] + dw
 
-def read_xml(path_to_xml):
+
+class GAPCommittee():
+    '''
+    Evaluates a committee of GAP models which only differ in their weights, e.g. samples from the posterior
+
+    The descriptors and the kernel vectors against the sparse points are computed once per configuration
+    and shared by all committee members, which are then evaluated together with a product against the
+    (total_nsparse, committee_size) weight matrix. Only a single copy of the model is kept in memory.
+
+    Key Attributes:
+    self.gap : GAPXMLWrapper of the model
+    self.weights : Weights of the committee members, shape (total_nsparse, committee_size)
+    self.committee_size : Number of committee members
+
+    Key Methods:
+    self.calculate(at, forces=True) : Energies and forces of all committee members for an ase.Atoms object
+    self.get_potential_energies(at) : Energies of all committee members, shape (committee_size,)
+    self.get_forces(at) : Forces of all committee members, shape (committee_size, n_atoms, 3)
+    '''
+
+    def __init__(self, gap, weights):
+        weights = np.asarray(weights, dtype=float)
+
+        if weights.ndim == 1:
+            weights = weights[:, np.newaxis]
+
+        if weights.shape[0] != gap.total_nsparse:
+            raise ValueError(f"weights have {weights.shape[0]} rows, but the model has {gap.total_nsparse} sparse points")
+
+        self.gap = gap
+        self.weights = weights
+        self.committee_size = weights.shape[1]
+
+        # weights of each descriptor GP, in the order of GAPXMLWrapper.weights
+        offsets = np.cumsum([0] + [desc.nsparse for desc in gap.descriptors])
+        self._desc_weights = [weights[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+        self._sparse_X = [desc.sparse_X(gap.xml_dir) for desc in gap.descriptors]
+        self._core = gap.core_potential()
+
+    def calculate(self, at, forces=True):
+        '''
+        Return dict of committee energies, shape (committee_size,) and, if forces=True,
+        committee forces, shape (committee_size, n_atoms, 3) for ase.Atoms at
+        '''
+        n_atoms = len(at)
+
+        energy = np.full(self.committee_size, sum(self.gap.isolated_atom_energies.get(Z, 0.0) for Z in at.numbers))
+        if forces:
+            force = np.zeros((n_atoms, self.committee_size, 3))
+
+        for desc, weights, sparse_X in zip(self.gap.descriptors, self._desc_weights, self._sparse_X):
+            desc_out = desc.quip_desc.calc(at, grad=forces)
+
+            if len(desc_out.get("covariance_cutoff", [])) == 0:  # no descriptors of this kind in at
+                continue
+
+            has_data = np.asarray(desc_out["has_data"], dtype=bool)
+            cutoff = desc_out["covariance_cutoff"]
+
+            if not forces:
+                pred = desc.predict(desc_out["data"], sparse_X, weights)
+                energy += np.sum(cutoff[has_data, np.newaxis] * pred[has_data], axis=0)
+                continue
+
+            pred, pred_grad = desc.predict(desc_out["data"], sparse_X, weights, grad=True)
+            energy += np.sum(cutoff[has_data, np.newaxis] * pred[has_data], axis=0)
+
+            # descriptor and atom of each gradient entry
+            desc_index = np.repeat(np.arange(len(cutoff)), [len(ii) for ii in desc_out["ii"]])
+            atom_index = desc_out["grad_index_0based"][:, 1]
+            mask = has_data[desc_index] & np.concatenate(desc_out["has_grad_data"]).astype(bool)
+            desc_index = desc_index[mask]
+
+            # d(cutoff * pred) / dr for each gradient entry and committee member
+            grad = (np.einsum("gcd,gmd->gmc", desc_out["grad_data"][mask], pred_grad[desc_index])
+                    * cutoff[desc_index, np.newaxis, np.newaxis]
+                    + pred[desc_index, :, np.newaxis] * desc_out["grad_covariance_cutoff"][mask][:, np.newaxis, :])
+            np.add.at(force, atom_index[mask], -grad)
+
+        if self._core is not None:
+            energy += self._core.get_potential_energy(at)
+            if forces:
+                force += self._core.get_forces(at)[:, np.newaxis, :]
+
+        results = {"energy": energy}
+        if forces:
+            results["forces"] = force.transpose((1, 0, 2))
+
+        return results
+
+    def get_potential_energies(self, at):
+        '''
+        Return energies of all committee members for ase.Atoms at, shape (committee_size,)
+        '''
+        return self.calculate(at, forces=False)["energy"]
+
+    def get_forces(self, at):
+        '''
+        Return forces of all committee members for ase.Atoms at, shape (committee_size, n_atoms, 3)
+        '''
+        return self.calculate(at)["forces"]
+
+
+def _triangle(R, block_size=1024):
+    '''
+    Return "upper" or "lower" if R is upper or lower triangular, "full" otherwise
+    R is checked in blocks of rows, so memory-mapped matrices are not loaded all at once
+    '''
+    upper = lower = True
+
+    for start in range(0, R.shape[0], block_size):
+        block = np.asarray(R[start:start + block_size])
+        upper = upper and not np.any(np.tril(block, k=start - 1))
+        lower = lower and not np.any(np.triu(block, k=start + 1))
+
+        if not (upper or lower):
+            return "full"
+
+    return "upper" if upper else "lower"
+
+
+def _load_R(R_fname, nsparse, cache=True):
+    '''
+    Read the posterior R matrix from the text file R_fname
+
+    If cache is True, R is also written to R_fname + ".npy", which is memory-mapped on later
+    calls as long as it is newer than the text file
+    '''
+    cache_fname = R_fname + ".npy"
+
+    if cache and os.path.exists(cache_fname) and os.path.getmtime(cache_fname) >= os.path.getmtime(R_fname):
+        R = np.load(cache_fname, mmap_mode="r")
+        if R.shape == (nsparse, nsparse):
+            return R
+
+    # much faster than np.loadtxt, and without the per-line temporaries
+    R = np.fromfile(R_fname, sep=" ").reshape((nsparse, nsparse)).T
+
+    if cache:
+        tmp_fname = cache_fname + ".tmp" + str(os.getpid())
+        try:
+            with open(tmp_fname, "wb") as f:
+                np.save(f, R)
+            os.replace(tmp_fname, cache_fname)
+        except OSError: # e.g. read-only directory, just use R from the text file
+            if os.path.exists(tmp_fname):
+                os.remove(tmp_fname)
+
+    return R
+
+
+def read_xml(path_to_xml, cache_R=True):
     '''
     Generate an instance of GAPXMLWrapper for given XML file
+    If cache_R, the posterior R matrix is cached as <GAP_fname>.R.<GAP_label>.npy next to the text file
     '''
 
     xml_dir = os.path.dirname(path_to_xml)
@@ -243,10 +518,7 @@ def read_xml(path_to_xml):
     R_fname = path_to_xml + ".R." + gap.gap_label
 
     if os.path.exists(R_fname):
-        gap.R = np.loadtxt(R_fname).reshape(
-            (gap.total_nsparse, gap.total_nsparse)).T
-    else:
-        gap.R = None
+        gap.R = _load_R(R_fname, gap.total_nsparse, cache=cache_R)
 
     return gap
 
@@ -277,3 +549,18 @@ def get_calc_committee(path_to_xml, committee_size, return_core_wrapper=False):
         return calc_committee, gap_wrapper
     else:
         return calc_committee
+
+
+def get_committee(path_to_xml, committee_size, return_core_wrapper=False):
+    '''
+    Sample a committee based on the model defined by path_to_xml XML file, as a single GAPCommittee
+    Cheaper than get_calc_committee, as all committee members share one descriptor and kernel evaluation
+    '''
+    gap_wrapper = read_xml(path_to_xml)
+
+    committee = gap_wrapper.as_committee(gap_wrapper.draw_posterior_weights(committee_size))
+
+    if return_core_wrapper:
+        return committee, gap_wrapper
+    else:
+        return committee
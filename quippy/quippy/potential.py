@@ -60,6 +60,28 @@ class Potential(ase.calculators.calculator.Calculator):
         mpi_obj=None
         callback=None
         finalise=True
+
+    ------------------------------------------------------------------------
+    persistent: bool
+        Keep the Fortran Atoms object (and its Connection) alive between
+        calls to calculate(). If only positions, cell or atomic numbers
+        changed, the existing object is updated in place instead of
+        being rebuilt, so the neighbour list can be reused.
+    cutoff_skin: float or 'auto'
+        Verlet skin added to the neighbour list cutoff of the Fortran Atoms
+        object. With a non-zero skin, calc_connect() only does a full rebuild
+        once an atom has moved by more than half the skin, otherwise it just
+        updates the distances. Changes of the cell use up part of the skin
+        instead of forcing a rebuild. With 'auto', the skin is tuned at each
+        rebuild to give roughly one rebuild every 20 calls. Most useful
+        together with `persistent=True`.
+    zero_copy: bool
+        Do not copy the results out of the Fortran Atoms object. The arrays in
+        `results` and `extra_results` are then views onto memory owned by
+        Fortran, and `extra_results` only pulls an entry from Fortran when it
+        is first accessed. The views are only valid until the next call to
+        calculate(): copy anything that is needed for longer. Values returned
+        by the ASE getters (e.g. get_forces()) are copies and are not affected.
     """)
     def __init__(self, args_str="",
                  pot1=None, pot2=None,
@@ -67,7 +89,8 @@ class Potential(ase.calculators.calculator.Calculator):
                  param_filename=None,
                  atoms=None,
                  calculation_always_required=False, calc_args=None,
-                 add_arrays=None, add_info=None, **kwargs):
+                 add_arrays=None, add_info=None,
+                 persistent=False, cutoff_skin=0.0, zero_copy=False, **kwargs):
         quippy.potential_module.Potential.__init__.__doc__
 
         self._default_properties = ['energy', 'forces']
@@ -93,6 +116,11 @@ class Potential(ase.calculators.calculator.Calculator):
 
         # init the quip atoms as None, to have the variable
         self._quip_atoms = None
+        # reuse of the quip atoms between calculations
+        self.persistent = persistent
+        self.cutoff_skin = cutoff_skin
+        self.zero_copy = zero_copy
+        self._quip_result_keys = ([], [])
         # init the info and array keys that need to be added when converting atoms objects
         self.add_arrays = add_arrays
         self.add_info = add_info
@@ -235,9 +263,22 @@ class Potential(ase.calculators.calculator.Calculator):
 
         # construct the quip atoms object which we will use to calculate on
         # if add_arrays/add_info given to this object is not None, then OVERWRITES the value set in __init__
-        self._quip_atoms = quippy.convert.ase_to_quip(self.atoms,
+        if self.persistent and self._quip_atoms is not None and _can_update_in_place(system_changes):
+            # keep the Fortran object and its connectivity, only clear results of the previous calculation
+            self._remove_quip_results()
+            quip_atoms = self._quip_atoms
+        else:
+            quip_atoms = None
+        self._quip_atoms = quippy.convert.ase_to_quip(self.atoms, quip_atoms=quip_atoms,
                                                       add_arrays=add_arrays if add_arrays is not None else self.add_arrays,
                                                       add_info=add_info if add_info is not None else self.add_info)
+        if self.cutoff_skin == 'auto':
+            self._quip_atoms.connect.auto_skin = True
+        elif self.cutoff_skin:
+            self._quip_atoms.cutoff_skin = self.cutoff_skin
+        if self.persistent:
+            _input_keys = (quippy.convert.get_dict_keys(self._quip_atoms.properties),
+                           quippy.convert.get_dict_keys(self._quip_atoms.params))
 
         # constructing args_string with automatically aliasing the calculateable non-quippy properties
         # calc_args string to be passed to Fortran code
@@ -269,8 +310,22 @@ class Potential(ase.calculators.calculator.Calculator):
         self._quip_potential.calc(self._quip_atoms, args_str=args_str, energy=ener_dummy, **_dict_args)
 
         # retrieve data from _quip_atoms.properties and _quip_atoms.params
-        _quip_properties = quippy.convert.get_dict_arrays(self._quip_atoms.properties)
-        _quip_params = quippy.convert.get_dict_arrays(self._quip_atoms.params)
+        if self.zero_copy:
+            # only views, pulled from Fortran when needed
+            _quip_properties = quippy.convert.LazyDictArrays(self._quip_atoms.properties, copy=False,
+                                                             owner=self._quip_atoms)
+            _quip_params = quippy.convert.LazyDictArrays(self._quip_atoms.params, copy=False,
+                                                         owner=self._quip_atoms)
+            _copy = _no_copy
+        else:
+            _quip_properties = quippy.convert.get_dict_arrays(self._quip_atoms.properties)
+            _quip_params = quippy.convert.get_dict_arrays(self._quip_atoms.params)
+            _copy = np.copy
+
+        if self.persistent:
+            # remember what the calculation added, so it can be removed before the next one
+            self._quip_result_keys = ([key for key in _quip_properties.keys() if key not in _input_keys[0]],
+                                      [key for key in _quip_params.keys() if key not in _input_keys[1]])
 
         self.results['energy'] = ener_dummy[0]
         self.results['free_energy'] = self.results['energy']
@@ -282,17 +337,17 @@ class Potential(ase.calculators.calculator.Calculator):
             # convert to 6-element array in Voigt order
             self.results['stress'] = np.array([stress[0, 0], stress[1, 1], stress[2, 2],
                                                stress[1, 2], stress[0, 2], stress[0, 1]])
-            self.extra_results['config']['virial'] = _quip_params['virial'].copy()
+            self.extra_results['config']['virial'] = _copy(_quip_params['virial'])
 
         if 'force' in _quip_properties.keys():
-            self.results['forces'] = np.copy(_quip_properties['force'].T)
+            self.results['forces'] = _copy(_quip_properties['force'].T)
 
         if 'local_energy' in _quip_properties.keys():
-            self.results['energies'] = np.copy(_quip_properties['local_energy'])
-            self.extra_results['atoms']['local_energy'] = np.copy(_quip_properties['local_energy'])
+            self.results['energies'] = _copy(_quip_properties['local_energy'])
+            self.extra_results['atoms']['local_energy'] = _copy(_quip_properties['local_energy'])
 
         if 'local_virial' in _quip_properties.keys():
-            self.extra_results['atoms']['local_virial'] = np.copy(_quip_properties['local_virial'])
+            self.extra_results['atoms']['local_virial'] = _copy(_quip_properties['local_virial'])
 
         if 'stresses' in properties:
             # use the correct atomic volume
@@ -319,6 +374,16 @@ class Potential(ase.calculators.calculator.Calculator):
                                                       'map_shift', 'n_neighb',
                                                       'force', 'local_energy',
                                                       'local_virial', 'velo'])
+        if self.zero_copy:
+            # the remaining entries are only pulled from Fortran when accessed
+            for key, fdict, transpose in [('config', self._quip_atoms.params, False),
+                                          ('atoms', self._quip_atoms.properties, True)]:
+                lazy = quippy.convert.LazyDictArrays(fdict, copy=False, transpose=transpose,
+                                                     exclude=_skip_keys, owner=self._quip_atoms)
+                lazy.update(self.extra_results[key])
+                self.extra_results[key] = lazy
+            return
+
         # any other params (per-config properties)
         for param, val in _quip_params.items():
             if param not in _skip_keys:
@@ -330,6 +395,91 @@ class Potential(ase.calculators.calculator.Calculator):
                 # transpose before copying because of setting `order=C` here; issue#151
                 self.extra_results['atoms'][prop] = np.copy(val.T, order='C')
 
+    def calculate_batch(self, atoms_list, properties=None, calc_args=None, **kwargs):
+        """
+        Evaluate the potential on many configurations in a single call
+
+        The loop over the configurations runs in Fortran (`Potential.calc_batch()`),
+        reusing one Atoms object while consecutive configurations have the same
+        number of atoms, which avoids the per-call Python overhead of `calculate()`
+        for small configurations. No constraints are applied and `self.results`
+        is left untouched.
+
+        atoms_list: list of ase.atoms.Atoms objects
+        properties: list of str
+            Any combination of 'energy', 'forces' and 'stress', defaults to
+            'energy' and 'forces'. The energy is always calculated.
+        calc_args: argument string or dict passed to the Fortran calc() routine,
+            appended to `self.calc_args`. Additional keyword arguments are appended too.
+
+        Returns a dictionary of stacked arrays:
+            'energy'  - shape (n_frames,)
+            'offsets' - shape (n_frames + 1,), atoms of frame i are offsets[i]:offsets[i+1]
+            'forces'  - shape (n_atoms_total, 3), if requested
+            'virial'  - shape (n_frames, 3, 3), if stress is requested
+            'stress'  - shape (n_frames, 6) in Voigt order, if requested
+        """
+
+        if properties is None:
+            properties = self.get_default_properties()
+        for prop in properties:
+            if prop not in ['energy', 'free_energy', 'forces', 'stress']:
+                raise RuntimeError("Don't know how to calculate property '%s' in a batch" % prop)
+
+        n_frames = len(atoms_list)
+        offsets = np.zeros(n_frames + 1, dtype=np.int32)
+        offsets[1:] = np.cumsum([len(at) for at in atoms_list])
+        n_total = int(offsets[-1])
+
+        z = np.zeros(n_total, dtype=np.int32)
+        pos = np.zeros((3, n_total), order='F')
+        lattice = np.zeros((3, 3, n_frames), order='F')
+        pbc = np.zeros((3, n_frames), dtype=np.int32, order='F')
+        for i, at in enumerate(atoms_list):
+            z[offsets[i]:offsets[i + 1]] = at.numbers
+            pos[:, offsets[i]:offsets[i + 1]] = at.positions.T
+            lattice[:, :, i] = at.get_cell().T
+            pbc[:, i] = at.get_pbc()
+
+        args_str = self.calc_args
+        if calc_args is not None:
+            if isinstance(calc_args, dict):
+                calc_args = key_val_dict_to_str(calc_args)
+            args_str += ' ' + calc_args
+        if kwargs:
+            args_str += ' ' + key_val_dict_to_str(kwargs)
+
+        energy = np.zeros(n_frames)
+        _dict_args = {}
+        if 'forces' in properties:
+            _dict_args['force'] = np.zeros((3, n_total), order='F')
+        if 'stress' in properties:
+            _dict_args['virial'] = np.zeros((3, 3, n_frames), order='F')
+
+        self._quip_potential.calc_batch(offsets, z, pos, lattice, pbc, energy, args_str=args_str, **_dict_args)
+
+        results = {'energy': energy, 'offsets': offsets}
+        if 'forces' in properties:
+            results['forces'] = np.copy(_dict_args['force'].T, order='C')
+        if 'stress' in properties:
+            virial = np.transpose(_dict_args['virial'], (2, 0, 1))
+            volumes = np.array([at.get_volume() for at in atoms_list])
+            stress = -virial / volumes[:, np.newaxis, np.newaxis]
+            results['virial'] = np.copy(virial, order='C')
+            results['stress'] = np.stack([stress[:, 0, 0], stress[:, 1, 1], stress[:, 2, 2],
+                                          stress[:, 1, 2], stress[:, 0, 2], stress[:, 0, 1]], axis=1)
+        return results
+
+    def _remove_quip_results(self):
+        """Remove properties and params written by the previous calculation from the persistent quip atoms"""
+        prop_keys, param_keys = self._quip_result_keys
+        for key in prop_keys:
+            if key not in ('map_shift', 'n_neighb'):
+                self._quip_atoms.remove_property(key)
+        for key in param_keys:
+            self._quip_atoms.params.remove_value(key)
+        self._quip_result_keys = ([], [])
+
     def get_virial(self, atoms=None):
         self.get_stress(atoms)
         return self.extra_results['config']['virial']
@@ -356,6 +506,18 @@ class Potential(ase.calculators.calculator.Calculator):
         self._default_properties = properties[:]
 
 
+def _can_update_in_place(system_changes):
+    """Checks if the quip atoms object can be updated in place for the given system changes"""
+
+    if system_changes is None:
+        return False
+    return set(system_changes) <= {'positions', 'cell', 'numbers'}
+
+
+def _no_copy(value):
+    return value
+
+
 def _check_arg(arg):
     """Checks if the argument is True bool or string meaning True"""
 
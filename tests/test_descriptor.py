@@ -21,6 +21,7 @@
 
 import unittest
 import os
+import tempfile
 
 import numpy as np
 import ase
@@ -241,6 +242,72 @@ class Test_Descriptor(quippytest.QuippyTestCase):
             for ii_item in set(ii_arr - 1):
                 assert ii_item in grad_data
 
+    def test_connectivity_reused(self):
+        desc = quippy.descriptors.Descriptor("distance_2b cutoff=2.0")
+        at = self.at_C2H.copy()
+
+        # one conversion of the ASE Atoms, shared by all calls until it changes
+        data = desc.calc(at)
+        quip_at = quippy.descriptors._get_quip_atoms(at)
+        connect_key = quip_at._connect_key
+        self.assertEqual(desc.count(at), data['data'].shape[0])
+        self.assertTrue(quippy.descriptors._get_quip_atoms(at) is quip_at)
+        self.assertEqual(quip_at._connect_key, connect_key)
+
+        # a descriptor with a smaller cutoff shares the connectivity
+        quippy.descriptors.Descriptor("distance_2b cutoff=1.5").calc(at)
+        self.assertEqual(quip_at._connect_key, connect_key)
+
+        at.positions[0] += 0.1
+        data_moved = desc.calc(at)
+        self.assertFalse(quippy.descriptors._get_quip_atoms(at) is quip_at)
+        self.assertArrayAlmostEqual(data_moved['data'],
+                                    desc.calc(quippy.convert.ase_to_quip(at, add_arrays=True))['data'])
+
+    def test_connectivity_cache_bounded(self):
+        desc = quippy.descriptors.Descriptor("distance_2b cutoff=2.0")
+        frames = []
+        for i in range(3 * quippy.descriptors._QUIP_ATOMS_CACHE_SIZE):
+            at = self.at_C2H.copy()
+            at.rattle(0.01, seed=i)
+            frames.append(at)
+            desc.calc(at)
+            self.assertLessEqual(len(quippy.descriptors._quip_atoms_cache), quippy.descriptors._QUIP_ATOMS_CACHE_SIZE)
+
+        # the most recent frame is still cached, the first one has been dropped
+        self.assertTrue(quippy.descriptors._get_quip_atoms(frames[-1]) is quippy.descriptors._get_quip_atoms(frames[-1]))
+        self.assertNotIn(id(frames[0]), quippy.descriptors._quip_atoms_cache)
+
+    def test_calc_dataset(self):
+        desc = quippy.descriptors.Descriptor("soap cutoff=2.5 l_max=2 n_max=2 atom_sigma=0.5")
+        frames = []
+        for i in range(5):
+            at = ase.build.bulk('Si', 'diamond', a=5.43) * (1, 1, 1 + i % 2)
+            at.rattle(0.05, seed=i)
+            frames.append(at)
+
+        ref = [desc.calc(at, grad=True) for at in frames]
+
+        for n_workers in [1, 2]:
+            with tempfile.TemporaryDirectory() as out:
+                index = desc.calc_dataset(frames, out, n_workers=n_workers, grad=True, chunk_size=2)
+                self.assertEqual(index['n_frames'], len(frames))
+                self.assertEqual(len(index['shards']), 3)
+
+                data = np.concatenate([np.load(os.path.join(out, shard['data'])) for shard in index['shards']])
+                grad_data = np.concatenate([np.load(os.path.join(out, shard['grad_data']))
+                                            for shard in index['shards']])
+                grad_index = np.concatenate([np.load(os.path.join(out, shard['grad_index']))
+                                             for shard in index['shards']])
+                offsets = np.load(os.path.join(out, 'offsets.npy'))
+                grad_offsets = np.load(os.path.join(out, 'grad_offsets.npy'))
+
+                for i, res in enumerate(ref):
+                    self.assertArrayAlmostEqual(data[offsets[i]:offsets[i + 1]], res['data'])
+                    self.assertArrayAlmostEqual(grad_data[grad_offsets[i]:grad_offsets[i + 1]], res['grad_data'])
+                    self.assertArrayIntEqual(grad_index[grad_offsets[i]:grad_offsets[i + 1]],
+                                             res['grad_index_0based'])
+
 
 if __name__ == "__main__":
     unittest.main()
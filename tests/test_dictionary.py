@@ -0,0 +1,123 @@
+# HQ XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX
+# HQ X
+# HQ X   quippy: Python interface to QUIP atomistic simulation library
+# HQ X
+# HQ X   Copyright James Kermode 2020
+# HQ X
+# HQ X   These portions of the source code are released under the GNU General
+# HQ X   Public License, version 2, http://www.gnu.org/copyleft/gpl.html
+# HQ X
+# HQ X   If you would like to license the source code under different terms,
+# HQ X   please contact James Kermode, james.kermode@gmail.com
+# HQ X
+# HQ X   When using this software, please cite the following reference:
+# HQ X
+# HQ X   http://www.jrkermode.co.uk/quippy
+# HQ X
+# HQ XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX
+
+import unittest
+
+import quippy
+import quippytest
+from quippy.dictionary_module import Dictionary
+
+
+class TestDictionary_Lookup(quippytest.QuippyTestCase):
+
+    def setUp(self):
+        self.d = Dictionary()
+
+    def assertValues(self, d, values):
+        self.assertEqual(d.n, len(values))
+        for key, value in values.items():
+            self.assertEqual(d.get_value(key), (value, 1))
+            self.assertEqual(d.get_key(d.lookup_entry_i(key)).decode(), key)
+
+    def test_case_insensitive(self):
+        self.d.set_value('Energy', 1)
+        self.assertTrue(self.d.has_key('energy'))
+        self.assertTrue(self.d.has_key('ENERGY'))
+        self.assertEqual(self.d.get_value('eNeRgY'), (1, 1))
+        self.d.set_value('ENERGY', 2)
+        self.assertEqual(self.d.n, 1)
+        self.assertEqual(self.d.get_value('Energy'), (2, 1))
+
+    def test_case_sensitive(self):
+        self.d.set_value('Energy', 1)
+        self.assertTrue(self.d.has_key('Energy', case_sensitive=True))
+        self.assertFalse(self.d.has_key('energy', case_sensitive=True))
+        self.assertEqual(self.d.lookup_entry_i('energy', case_sensitive=True), -1)
+        self.assertEqual(self.d.lookup_entry_i('energy'), 1)
+
+    def test_trailing_blanks(self):
+        self.d.set_value('pad  ', 7)
+        self.assertTrue(self.d.has_key('pad'))
+        self.assertEqual(self.d.get_value('pad'), (7, 1))
+        self.d.set_value('pad', 8)
+        self.assertEqual(self.d.n, 1)
+        self.assertEqual(self.d.get_value('pad   '), (8, 1))
+
+    def test_missing_key(self):
+        self.d.set_value('a', 1)
+        self.assertFalse(self.d.has_key('b'))
+        self.assertEqual(self.d.lookup_entry_i('b'), -1)
+        self.assertEqual(self.d.get_value('b')[1], 0)
+
+    def test_growth(self):
+        # well past n_entry_block = 10, so the entries and the hash table are extended many times
+        values = {'Key%d' % i: i for i in range(500)}
+        for key, value in values.items():
+            self.d.set_value(key, value)
+        self.assertValues(self.d, values)
+        for key, value in values.items():
+            self.assertEqual(self.d.get_value(key.lower()), (value, 1))
+
+    def test_remove(self):
+        values = {'Key%d' % i: i for i in range(200)}
+        for key, value in values.items():
+            self.d.set_value(key, value)
+        # remove from the front, the back and the middle, checking the survivors after each removal
+        for i in [0, 199, 57, 58, 1, 100, 198, 3, 150, 151, 152]:
+            self.d.remove_value('key%d' % i)
+            del values['Key%d' % i]
+            self.assertFalse(self.d.has_key('Key%d' % i))
+            self.assertValues(self.d, values)
+        for i in range(0, 200, 3):
+            key = 'Key%d' % i
+            if key in values:
+                self.d.remove_value(key)
+                del values[key]
+        self.assertValues(self.d, values)
+        # removed keys can be added again
+        self.d.set_value('Key0', -1)
+        values['Key0'] = -1
+        self.assertValues(self.d, values)
+
+    def test_remove_all(self):
+        for i in range(30):
+            self.d.set_value('Key%d' % i, i)
+        for i in range(30):
+            self.d.remove_value('Key%d' % i)
+        self.assertEqual(self.d.n, 0)
+        self.assertFalse(self.d.has_key('Key0'))
+        self.d.set_value('Key0', 5)
+        self.assertValues(self.d, {'Key0': 5})
+
+    def test_swap(self):
+        values = {'Key%d' % i: i for i in range(25)}
+        for key, value in values.items():
+            self.d.set_value(key, value)
+        self.d.swap('Key0', 'key24')
+        self.assertEqual(self.d.get_key(1).decode(), 'Key24')
+        self.assertEqual(self.d.get_key(25).decode(), 'Key0')
+        self.assertEqual(self.d.lookup_entry_i('Key0'), 25)
+        self.assertEqual(self.d.lookup_entry_i('Key24'), 1)
+        self.assertValues(self.d, values)
+        self.d.remove_value('Key24')
+        del values['Key24']
+        self.assertValues(self.d, values)
+
+
+if __name__ == '__main__':
+    unittest.main()
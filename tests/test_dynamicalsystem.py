@@ -24,11 +24,17 @@ classes, for carrying out molecular dynamics simulations.
    :synopsis: Run molecular dynamics simulations
 """
 
+import os
+import re
+import tempfile
+
 import quippy
+import quippy.dynamicalsystem
 import numpy as np
 
 import unittest
 import quippytest
+import ase.build
 import ase.io
 
 
@@ -233,7 +239,147 @@ import ase.io
 #
 #         # Advance 10 steps with the Dynamics wrapper
 #         self.dyn.run(10)
-#
-#
-# if __name__ == '__main__':
-#     unittest.main()
+
+
+
+class TestDynamics_AutoSkin(quippytest.QuippyTestCase):
+    def setUp(self):
+        self.at = ase.build.bulk('Si', 'diamond', a=5.44, cubic=True)
+        self.at.rattle(0.01, seed=1)
+        self.at.set_momenta(np.random.RandomState(0).normal(scale=0.01, size=(len(self.at), 3)))
+
+    def run_dynamics(self, cutoff_skin):
+        at = self.at.copy()
+        at.calc = quippy.potential.Potential('IP SW', param_filename='SW_pot.xml', cutoff_skin=cutoff_skin)
+        dyn = quippy.dynamicalsystem.Dynamics(at, 1.0 * quippy.dynamicalsystem.fs, trajectory=None, logfile=None)
+        dyn.run(20)
+        return dyn
+
+    def test_native_run(self):
+        dyn = self.run_dynamics('auto')
+        self.assertTrue(dyn._quip_atoms.connect.auto_skin)
+        ref_dyn = self.run_dynamics(0.0)
+        self.assertArrayAlmostEqual(dyn.ase_atoms.get_positions(), ref_dyn.ase_atoms.get_positions())
+        self.assertArrayAlmostEqual(dyn.ase_atoms.get_velocities(), ref_dyn.ase_atoms.get_velocities())
+
+
+class TestDynamics_Native(quippytest.QuippyTestCase):
+    def setUp(self):
+        self.at = ase.build.bulk('Si', 'diamond', a=5.44, cubic=True)
+        self.at.rattle(0.01, seed=1)
+        self.at.set_momenta(np.random.RandomState(0).normal(scale=0.01, size=(len(self.at), 3)))
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def run_dynamics(self, native, n_steps=25):
+        at = self.at.copy()
+        at.calc = quippy.potential.Potential('IP SW', param_filename='SW_pot.xml')
+        # default log and trajectory intervals
+        dyn = quippy.dynamicalsystem.Dynamics(at, 1.0 * quippy.dynamicalsystem.fs, trajectory=None,
+                                              logfile=os.path.join(self.tmpdir.name, 'log'))
+        run_steps = dyn._ds.run_steps
+        self.n_calls = 0
+
+        def counting_run_steps(*args, **kwargs):
+            self.n_calls += 1
+            return run_steps(*args, **kwargs)
+
+        dyn._ds.run_steps = counting_run_steps
+        dyn.run(n_steps, native=native)
+        dyn.close()
+        return dyn
+
+    def test_native_matches_python(self):
+        ref_dyn = self.run_dynamics(native=False)
+        self.assertEqual(self.n_calls, 0)
+        dyn = self.run_dynamics(native=True)
+        # blocks of 10, 10 and 5 steps between the log and trajectory intervals
+        self.assertEqual(self.n_calls, 3)
+        self.assertEqual(dyn.nsteps, ref_dyn.nsteps)
+        self.assertArrayAlmostEqual(dyn.ase_atoms.get_positions(), ref_dyn.ase_atoms.get_positions(), tol=1e-10)
+        self.assertArrayAlmostEqual(dyn.ase_atoms.get_velocities(), ref_dyn.ase_atoms.get_velocities(), tol=1e-10)
+
+
+class TestDynamics_Writers(quippytest.QuippyTestCase):
+    def setUp(self):
+        self.at = ase.build.bulk('Si', 'diamond', a=5.44, cubic=True)
+        self.at.set_momenta(np.random.RandomState(0).normal(scale=0.01, size=(len(self.at), 3)))
+        self.at.calc = quippy.potential.Potential('IP SW', param_filename='SW_pot.xml')
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_trajectory_and_log(self):
+        traj_file = os.path.join(self.tmpdir.name, 'traj.xyz')
+        log_file = os.path.join(self.tmpdir.name, 'log')
+        dyn = quippy.dynamicalsystem.Dynamics(self.at, 1.0 * quippy.dynamicalsystem.fs, trajectory=traj_file,
+                                              trajectoryinterval=5, logfile=log_file, loginterval=2)
+        dyn.run(20)
+        dyn.close()
+
+        frames = ase.io.read(traj_file, ':')
+        self.assertEqual([at.info['nsteps'] for at in frames], [5, 10, 15, 20])
+        with open(log_file) as f:
+            lines = f.read().splitlines()
+        # header and one line every 2 steps
+        self.assertEqual(len(lines), 11)
+        # the column titles end where the fields after the label of the data lines end
+        ends = lambda line: [m.end() for m in re.finditer(r'\S+( \S+)?', line)]
+        self.assertEqual(len(ends(lines[0])), 6)
+        self.assertEqual(ends(lines[0]), ends(lines[1])[1:])
+
+
+class TestAsyncWriters(quippytest.QuippyTestCase):
+    def setUp(self):
+        self.at = ase.build.bulk('Si', 'diamond', a=5.44, cubic=True)
+        self.at.set_momenta(np.random.RandomState(0).normal(size=(len(self.at), 3)))
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_trajectory(self):
+        filename = os.path.join(self.tmpdir.name, 'traj.xyz')
+        frames = []
+        with quippy.dynamicalsystem.AsyncTrajectoryWriter(filename, properties=['tags'], maxsize=2) as writer:
+            for i in range(5):
+                self.at.positions[0, 0] += 0.1
+                self.at.set_tags(i)
+                frames.append(self.at.copy())
+                writer.write(self.at, nsteps=i)
+
+        read_frames = ase.io.read(filename, ':')
+        self.assertEqual(len(read_frames), len(frames))
+        for i, (at, ref_at) in enumerate(zip(read_frames, frames)):
+            self.assertEqual(at.info['nsteps'], i)
+            self.assertArrayAlmostEqual(at.positions, ref_at.positions)
+            self.assertArrayAlmostEqual(at.get_momenta(), ref_at.get_momenta())
+            self.assertArrayIntEqual(at.get_tags(), ref_at.get_tags())
+
+    def test_quip_atoms(self):
+        filename = os.path.join(self.tmpdir.name, 'traj.xyz')
+        quip_at = quippy.convert.ase_to_quip(self.at)
+        with quippy.dynamicalsystem.AsyncTrajectoryWriter(filename) as writer:
+            writer.write(quip_at)
+
+        at = ase.io.read(filename)
+        self.assertArrayAlmostEqual(at.positions, self.at.positions)
+        self.assertArrayAlmostEqual(at.cell, self.at.cell)
+        self.assertArrayAlmostEqual(at.get_momenta(), self.at.get_momenta())
+
+    def test_log(self):
+        filename = os.path.join(self.tmpdir.name, 'log')
+        writer = quippy.dynamicalsystem.AsyncLogWriter(filename)
+        for i in range(10):
+            writer.write('line {}'.format(i))
+        writer.close()
+
+        with open(filename) as f:
+            self.assertEqual(f.read().splitlines(), ['line {}'.format(i) for i in range(10)])
+
+
+if __name__ == '__main__':
+    unittest.main()
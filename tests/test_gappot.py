@@ -18,12 +18,17 @@
 
 import unittest
 import os
+import shutil
+import subprocess
+import sys
+import tempfile
 
 import quippy
 import numpy as np
 import quippytest
 import ase
 import ase.io
+import quippy.gap_tools
 
 @unittest.skipIf(os.environ['HAVE_GAP'] != '1', 'GAP support not enabled')
 class TestCalculator_GAP_Potential(quippytest.QuippyTestCase):
@@ -47,5 +52,173 @@ class TestCalculator_GAP_Potential(quippytest.QuippyTestCase):
     def test_forces(self):
         self.assertArrayAlmostEqual(self.at.get_forces(), self.forces_ref, tol=1E-06)
 
+
+@unittest.skipIf(os.environ['HAVE_GAP'] != '1', 'GAP support not enabled')
+class TestCalculator_GAP_CalcArgs(quippytest.QuippyTestCase):
+    """
+    Calc arguments that change how IPModel_GAP_Calc evaluates the model, but not the result
+    """
+
+    def setUp(self):
+        at_orig = ase.io.read('gap_sample.xyz')
+        self.at = ase.Atoms(numbers=at_orig.arrays['numbers'], positions=at_orig.get_positions(), pbc=True,
+                            cell=at_orig.get_cell())
+        self.ref = self.calc(quippy.potential.Potential("IP GAP", param_filename="GAP.xml"))
+
+    def calc(self, pot, calc_args=None):
+        at = self.at.copy()
+        pot.calculate(at, properties=['energy', 'forces', 'stress'], calc_args=calc_args)
+        return pot.results['energy'], pot.results['forces'], pot.extra_results['config']['virial'], \
+            set(pot.extra_results['atoms'].keys())
+
+    def assertSameResults(self, results, tol):
+        self.assertAlmostEqual(results[0], self.ref[0], delta=tol * max(abs(self.ref[0]), 1.0))
+        self.assertArrayAlmostEqual(results[1], self.ref[1], tol=tol * max(np.abs(self.ref[1]).max(), 1.0))
+        self.assertArrayAlmostEqual(results[2], self.ref[2], tol=tol * max(np.abs(self.ref[2]).max(), 1.0))
+
+    def test_descriptor_chunk_size(self):
+        pot = quippy.potential.Potential("IP GAP", param_filename="GAP.xml")
+        # 81 atoms: eight full chunks and a partial one, and a chunk per atom
+        for chunk_size in [10, 1]:
+            results = self.calc(pot, 'descriptor_chunk_size={}'.format(chunk_size))
+            self.assertSameResults(results, 1e-10)
+            # the chunk mask is only attached to the atoms during the calculation
+            self.assertFalse('gap_chunk_mask' in results[3])
+
+    def test_predict_block_size(self):
+        pot = quippy.potential.Potential("IP GAP", param_filename="GAP.xml")
+        # block sizes that do and do not divide the number of descriptor instances
+        for block_size in [1, 7, 64, 10000]:
+            self.assertSameResults(self.calc(pot, 'predict_block_size={}'.format(block_size)), 1e-10)
+        self.assertSameResults(self.calc(pot, 'predict_block_size=7 descriptor_chunk_size=10'), 1e-10)
+
+    def test_single_precision_kernel(self):
+        # the sparse points are rounded to single precision and the gradient products are done in single
+        # precision; energy, forces and virial must stay within 1e-5 relative of double precision
+        pot = quippy.potential.Potential("IP GAP single_precision_kernel=T", param_filename="GAP.xml")
+        self.assertSameResults(self.calc(pot), 1e-5)
+        self.assertSameResults(self.calc(pot, 'predict_block_size=7'), 1e-5)
+        self.assertSameResults(self.calc(pot, 'single_precision_check'), 1e-5)
+
+
+@unittest.skipIf(os.environ['HAVE_GAP'] != '1', 'GAP support not enabled')
+class TestCalculator_GAP_Threads(quippytest.QuippyTestCase):
+    """
+    The OpenMP thread count is fixed when the library is loaded, so each calculation runs in
+    a separate process with OMP_NUM_THREADS set, as in test_pot.TestPotential_Threads.
+    """
+
+    script = """
+import sys
+import ase
+import ase.io
+import numpy as np
+from quippy.potential import Potential
+at_orig = ase.io.read('gap_sample.xyz')
+at = ase.Atoms(numbers=at_orig.arrays['numbers'], positions=at_orig.get_positions(), pbc=True, cell=at_orig.get_cell())
+at.calc = Potential('IP GAP', param_filename='GAP.xml')
+at.calc.calculate(at, properties=['energy', 'forces', 'stress', 'stresses'], calc_args=sys.argv[1])
+np.savez(sys.argv[2], energy=at.calc.results['energy'], forces=at.calc.results['forces'],
+         virial=at.calc.extra_results['config']['virial'], local_virial=at.calc.extra_results['atoms']['local_virial'])
+"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def calc(self, calc_args, n_threads):
+        out_file = os.path.join(self.tmpdir.name, 'results_{}.npz'.format(n_threads))
+        env = os.environ.copy()
+        env['OMP_NUM_THREADS'] = str(n_threads)
+        # the sparse points of GAP.xml are read relative to the working directory
+        subprocess.run([sys.executable, '-c', self.script, calc_args, out_file],
+                       env=env, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        return np.load(out_file)
+
+    def check_threads(self, calc_args):
+        ref = self.calc(calc_args, 1)
+        res = self.calc(calc_args, 4)
+        self.assertAlmostEqual(float(res['energy']), float(ref['energy']), delta=1e-8)
+        self.assertArrayAlmostEqual(res['forces'], ref['forces'], tol=1e-8)
+        self.assertArrayAlmostEqual(res['virial'], ref['virial'], tol=1e-8)
+        self.assertArrayAlmostEqual(res['local_virial'], ref['local_virial'], tol=1e-8)
+
+    def test_threads(self):
+        self.check_threads('')
+
+    def test_threads_block_predict(self):
+        self.check_threads('predict_block_size=16')
+
+
+@unittest.skipIf(os.environ['HAVE_GAP'] != '1', 'GAP support not enabled')
+class TestGAPCommittee(quippytest.QuippyTestCase):
+    def setUp(self):
+        np.random.seed(1)
+        self.gap = quippy.gap_tools.read_xml('GAP.xml')
+        self.gap.R = np.eye(self.gap.total_nsparse) * 1e-5
+        self.samples = self.gap.draw_posterior_samples(2)
+        np.random.seed(None)
+
+        self.committee = self.gap.as_committee(np.stack([self.gap.weights] + [s.weights for s in self.samples], axis=1))
+        self.at = ase.io.read('gap_sample.xyz')
+
+    def test_committee(self):
+        results = self.committee.calculate(self.at)
+        self.assertEqual(results['forces'].shape, (3, len(self.at), 3))
+
+        for i, model in enumerate([self.gap] + self.samples):
+            at = self.at.copy()
+            at.calc = model.as_potential()
+            self.assertAlmostEqual(results['energy'][i], at.get_potential_energy(), delta=1e-6 * abs(results['energy'][i]))
+            self.assertArrayAlmostEqual(results['forces'][i], at.get_forces(), tol=1e-6 * np.abs(results['forces'][i]).max())
+
+    def test_energies_only(self):
+        self.assertArrayAlmostEqual(self.committee.get_potential_energies(self.at), self.committee.calculate(self.at)['energy'])
+
+
+@unittest.skipIf(os.environ['HAVE_GAP'] != '1', 'GAP support not enabled')
+class TestGAPPosterior(quippytest.QuippyTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        for fname in os.listdir('.'):
+            if fname.startswith('GAP.xml'):
+                shutil.copy(fname, self.dir)
+        self.xml_name = os.path.join(self.dir, 'GAP.xml')
+
+        gap = quippy.gap_tools.read_xml(self.xml_name)
+        n = gap.total_nsparse
+        self.R = np.triu(np.random.rand(n, n)) + n * np.eye(n)
+        np.savetxt(self.xml_name + '.R.' + gap.gap_label, self.R.T.reshape(-1))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_R_cache(self):
+        gap = quippy.gap_tools.read_xml(self.xml_name)
+        self.assertTrue(os.path.exists(self.xml_name + '.R.' + gap.gap_label + '.npy'))
+        self.assertArrayAlmostEqual(gap.R, self.R)
+
+        gap = quippy.gap_tools.read_xml(self.xml_name)
+        self.assertIsInstance(gap.R, np.memmap)
+        self.assertArrayAlmostEqual(gap.R, self.R)
+
+    def test_posterior_samples(self):
+        gap = quippy.gap_tools.read_xml(self.xml_name)
+
+        np.random.seed(1)
+        ref = [gap.mean_weights + np.linalg.solve(self.R, np.random.normal(size=gap.total_nsparse)) for i in range(4)]
+        np.random.seed(1)
+        samples = gap.draw_posterior_samples(4)
+        np.random.seed(None)
+
+        for sample, weights in zip(samples, ref):
+            self.assertArrayAlmostEqual(sample.weights, weights)
+            self.assertArrayAlmostEqual(np.concatenate([desc.weights for desc in sample.descriptors]), weights)
+
+            sample.save(os.path.join(self.dir, 'sample.xml'))
+            self.assertArrayAlmostEqual(quippy.gap_tools.read_xml(os.path.join(self.dir, 'sample.xml')).weights, weights)
+
 if __name__ == '__main__':
     unittest.main()
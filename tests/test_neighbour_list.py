@@ -16,10 +16,17 @@
 # HQ X
 # HQ XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX
 
+import os
+import subprocess
+import sys
+import tempfile
 import unittest
 
 import ase
+import ase.build
+import ase.neighborlist
 import numpy as np
+import quippy
 import quippytest
 from quippy.potential import Potential
 
@@ -86,6 +93,60 @@ class Test_NeighbourList(quippytest.QuippyTestCase):
         e = at.get_potential_energy()
         self.assertAlmostEqual(e, 20.863001205176083)
 
+    def test_csr(self):
+        at = ase.build.bulk('Si', cubic=True) * (2, 2, 1)
+        at.rattle(0.1, seed=1)
+        cutoff = 3.0
+
+        quip_at = quippy.convert.ase_to_quip(at)
+        quip_at.set_cutoff(cutoff)
+        quip_at.calc_connect(store_csr=True)
+        csr = quippy.convert.get_neighbour_csr(quip_at.connect)
+
+        i, j, d, S = ase.neighborlist.neighbor_list('ijdS', at, cutoff)
+        self.assertArrayAlmostEqual(csr['offsets'], np.concatenate([[0], np.cumsum(np.bincount(i, minlength=len(at)))]))
+        for atom in range(len(at)):
+            entries = slice(csr['offsets'][atom], csr['offsets'][atom + 1])
+            ref = sorted(zip(j[i == atom], map(tuple, S[i == atom]), d[i == atom]))
+            res = sorted(zip(csr['j'][entries], map(tuple, csr['shift'][entries]), csr['r_ij'][entries]))
+            self.assertEqual([x[:2] for x in res], [x[:2] for x in ref])
+            self.assertArrayAlmostEqual([x[2] for x in res], [x[2] for x in ref])
+
+
+    def test_csr_threads(self):
+        # the OpenMP thread count is fixed when the library is loaded, so each build runs in a subprocess
+        script = """
+import sys
+import ase.io
+import numpy as np
+import quippy
+quip_at = quippy.convert.ase_to_quip(ase.io.read(sys.argv[1]))
+quip_at.set_cutoff(4.0)
+quip_at.calc_connect(store_csr=True)
+np.savez(sys.argv[2], **quippy.convert.get_neighbour_csr(quip_at.connect))
+"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            at_file = os.path.join(tmpdir, 'at.xyz')
+            at = ase.build.bulk('Si', cubic=True) * (3, 3, 2)
+            at.rattle(0.1, seed=1)
+            at.pbc = [True, True, False]
+            at.write(at_file)
+
+            csrs = []
+            for n_threads in [1, 2, 4]:
+                out_file = os.path.join(tmpdir, 'csr_{}.npz'.format(n_threads))
+                env = os.environ.copy()
+                env['OMP_NUM_THREADS'] = str(n_threads)
+                subprocess.run([sys.executable, '-c', script, at_file, out_file], env=env, check=True)
+                csrs.append(dict(np.load(out_file)))
+
+        ref = csrs[0]
+        self.assertGreater(len(ref['j']), 0)
+        for csr in csrs[1:]:
+            self.assertArrayIntEqual(csr['offsets'], ref['offsets'])
+            self.assertArrayIntEqual(csr['j'], ref['j'])
+            self.assertArrayIntEqual(csr['shift'], ref['shift'])
+            self.assertArrayAlmostEqual(csr['r_ij'], ref['r_ij'], tol=0.0)
 
 if __name__ == '__main__':
     unittest.main()
@@ -36,6 +36,10 @@ $bash: python2
  [ 1.37788647  4.08297002  4.12304365]]
 """
 
+import os
+import subprocess
+import sys
+import tempfile
 import unittest
 import quippy
 import numpy as np
@@ -200,7 +204,415 @@ class TestPotential(quippytest.QuippyTestCase):
             at.calc = calc
             E_RS.append(at.get_potential_energy())
             
-        self.assertArrayAlmostEqual(E_RS, E_RS_ref)  
-            
+        self.assertArrayAlmostEqual(E_RS, E_RS_ref)
+
+
+class TestPotential_Persistent(quippytest.QuippyTestCase):
+
+    def setUp(self):
+        self.LJ_str = """<LJ_params n_types="1" label="default">
+        <!-- dummy paramters for testing purposes, no physical meaning -->
+        <per_type_data type="1" atomic_num="13" />
+        <per_pair_data type1="1" type2="1" sigma="2.0" eps6="1.0" eps12="1.0" cutoff="4.0" energy_shift="T" linear_force_shift="F" />
+        </LJ_params>
+        """
+        self.at = ase.build.bulk('Al', 'fcc', a=4.05, cubic=True) * (2, 2, 2)
+        self.at.rattle(0.05, seed=1)
+
+    def test_same_results(self):
+        ref_calc = Potential(param_str=self.LJ_str, args_str='IP LJ')
+        calc = Potential(param_str=self.LJ_str, args_str='IP LJ', persistent=True, cutoff_skin=1.0)
+
+        at = self.at.copy()
+        at.calc = calc
+        rng = np.random.RandomState(0)
+        for step in range(5):
+            at.positions += rng.uniform(-0.05, 0.05, size=at.positions.shape)
+            if step == 3:
+                at.set_cell(at.cell * 1.01, scale_atoms=True)
+            ref_at = at.copy()
+            ref_at.calc = ref_calc
+            self.assertAlmostEqual(at.get_potential_energy(), ref_at.get_potential_energy())
+            self.assertArrayAlmostEqual(at.get_forces(), ref_at.get_forces())
+            self.assertArrayAlmostEqual(at.get_stress(), ref_at.get_stress())
+
+    def test_quip_atoms_reused(self):
+        calc = Potential(param_str=self.LJ_str, args_str='IP LJ', persistent=True, cutoff_skin=1.0)
+        at = self.at.copy()
+        at.calc = calc
+        at.get_potential_energy()
+        quip_atoms = calc._quip_atoms
+        self.assertAlmostEqual(quip_atoms.cutoff_skin, 1.0)
+
+        at.positions[0] += 0.1
+        at.get_potential_energy()
+        self.assertTrue(calc._quip_atoms is quip_atoms)
+
+        # a change of the number of atoms needs a new object
+        del at[-1]
+        at.get_potential_energy()
+        self.assertFalse(calc._quip_atoms is quip_atoms)
+
+    def test_no_stale_results(self):
+        calc = Potential(param_str=self.LJ_str, args_str='IP LJ', persistent=True)
+        at = self.at.copy()
+        at.calc = calc
+        at.get_potential_energies()
+        self.assertTrue('local_energy' in calc.extra_results['atoms'])
+
+        at.positions[0] += 0.1
+        at.get_potential_energy()
+        self.assertFalse('local_energy' in calc.extra_results['atoms'])
+        self.assertFalse('energies' in calc.results)
+
+
+class TestPotential_ZeroCopy(quippytest.QuippyTestCase):
+
+    def setUp(self):
+        self.LJ_str = """<LJ_params n_types="1" label="default">
+        <!-- dummy paramters for testing purposes, no physical meaning -->
+        <per_type_data type="1" atomic_num="13" />
+        <per_pair_data type1="1" type2="1" sigma="2.0" eps6="1.0" eps12="1.0" cutoff="4.0" energy_shift="T" linear_force_shift="F" />
+        </LJ_params>
+        """
+        self.at = ase.build.bulk('Al', 'fcc', a=4.05, cubic=True) * (2, 2, 2)
+        self.at.rattle(0.05, seed=1)
+
+    def test_same_results(self):
+        ref_calc = Potential(param_str=self.LJ_str, args_str='IP LJ')
+        calc = Potential(param_str=self.LJ_str, args_str='IP LJ', zero_copy=True)
+
+        for c in [ref_calc, calc]:
+            c.calculate(self.at.copy(), properties=['energy', 'forces', 'stress', 'energies'])
+
+        for key in ['energy', 'forces', 'stress', 'energies']:
+            self.assertArrayAlmostEqual(np.asarray(calc.results[key]), np.asarray(ref_calc.results[key]))
+
+        for key in ['config', 'atoms']:
+            self.assertEqual(set(calc.extra_results[key].keys()), set(ref_calc.extra_results[key].keys()))
+            for name in ref_calc.extra_results[key]:
+                self.assertArrayAlmostEqual(np.asarray(calc.extra_results[key][name]),
+                                            np.asarray(ref_calc.extra_results[key][name]))
+
+    def test_views(self):
+        calc = Potential(param_str=self.LJ_str, args_str='IP LJ', zero_copy=True)
+        calc.calculate(self.at.copy(), properties=['energy', 'forces'])
+        self.assertFalse(calc.results['forces'].flags.owndata)
+        self.assertEqual(calc.results['forces'].shape, (len(self.at), 3))
+
+        # getters still hand out copies
+        forces = calc.get_forces()
+        self.assertTrue(forces.flags.owndata)
+
+    def test_lazy_extra_results(self):
+        calc = Potential(param_str=self.LJ_str, args_str='IP LJ', zero_copy=True)
+        at = self.at.copy()
+        at.new_array('dummy', np.arange(len(at), dtype=float))
+        calc.calculate(at, properties=['energy', 'forces'], add_arrays='dummy')
+
+        extra = calc.extra_results['atoms']
+        self.assertTrue(isinstance(extra, quippy.convert.LazyDictArrays))
+        self.assertTrue('dummy' in extra)
+        self.assertEqual(len(extra._values), 0)
+        self.assertArrayAlmostEqual(extra['dummy'], np.arange(len(at), dtype=float))
+        self.assertEqual(list(extra._values.keys()), ['dummy'])
+
+
+class TestPotential_Batch(quippytest.QuippyTestCase):
+
+    def setUp(self):
+        LJ_str = """<LJ_params n_types="1" label="default">
+        <!-- dummy paramters for testing purposes, no physical meaning -->
+        <per_type_data type="1" atomic_num="13" />
+        <per_pair_data type1="1" type2="1" sigma="2.0" eps6="1.0" eps12="1.0" cutoff="4.0" energy_shift="T" linear_force_shift="F" />
+        </LJ_params>
+        """
+        self.calc = Potential(param_str=LJ_str, args_str='IP LJ')
+        np.random.seed(0)
+        self.ats = []
+        for n in [4, 4, 5, 3, 3]:
+            self.ats.append(Atoms('Al%d' % n, cell=(5, 5, 5),
+                                  scaled_positions=np.random.uniform(size=(n, 3)),
+                                  pbc=[True] * 3))
+
+    def test_calculate_batch(self):
+        results = self.calc.calculate_batch(self.ats, properties=['energy', 'forces', 'stress'])
+        self.assertArrayIntEqual(results['offsets'], [0, 4, 8, 13, 16, 19])
+
+        for i, at in enumerate(self.ats):
+            at.calc = self.calc
+            self.assertAlmostEqual(results['energy'][i], at.get_potential_energy())
+            self.assertArrayAlmostEqual(results['forces'][results['offsets'][i]:results['offsets'][i + 1]],
+                                        at.get_forces())
+            self.assertArrayAlmostEqual(results['stress'][i], at.get_stress())
+
+
+class TestPotential_ArgsCache(quippytest.QuippyTestCase):
+    """
+    potential_calc and Potential_Simple_Calc keep the values parsed from the last args_str,
+    so a change of args_str on the same Potential must be parsed again.
+    """
+
+    def setUp(self):
+        param_filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'SW_pot.xml')
+        self.pot = Potential('IP SW', param_filename=param_filename)
+        self.at = ase.build.bulk('Si', 'diamond', a=5.44, cubic=True) * (2, 2, 2)
+        self.at.rattle(0.05, seed=1)
+
+        ref_calc = Potential('IP SW', param_filename=param_filename)
+        ref_calc.calculate(self.at.copy(), properties=['energy', 'forces', 'stresses'])
+        self.ref = ref_calc
+
+    def calc(self, args_str):
+        quip_atoms = quippy.convert.ase_to_quip(self.at)
+        energy = np.zeros(1)
+        self.pot._quip_potential.calc(quip_atoms, args_str=args_str, energy=energy)
+        return energy[0], quippy.convert.get_dict_arrays(quip_atoms.properties)
+
+    def test_changed_args_str(self):
+        energy, props = self.calc('energy')
+        self.assertAlmostEqual(energy, self.ref.results['energy'])
+        self.assertFalse('force' in props)
+
+        energy, props = self.calc('energy force')
+        self.assertArrayAlmostEqual(props['force'].T, self.ref.results['forces'])
+        self.assertFalse('local_virial' in props)
+
+        energy, props = self.calc('energy local_virial')
+        self.assertFalse('force' in props)
+        self.assertArrayAlmostEqual(props['local_virial'], self.ref.extra_results['atoms']['local_virial'])
+
+        energy, props = self.calc('energy')
+        self.assertFalse('force' in props)
+        self.assertFalse('local_virial' in props)
+
+        # a changed value of an argument, rather than its presence, is picked up too
+        energy, props = self.calc('energy force=extra_force')
+        self.assertFalse('force' in props)
+        self.assertArrayAlmostEqual(props['extra_force'].T, self.ref.results['forces'])
+
+
+class TestPotential_Threads(quippytest.QuippyTestCase):
+    """
+    The OpenMP thread count is fixed when the library is loaded, so each calculation runs in
+    a separate process with OMP_NUM_THREADS set, as for the gap_fit tests.
+    """
+
+    script = """
+import sys
+import ase.io
+import numpy as np
+from quippy.potential import Potential
+at = ase.io.read(sys.argv[3])
+at.calc = Potential(sys.argv[1], param_filename=sys.argv[2])
+at.calc.calculate(at, properties=['energy', 'forces', 'virial'])
+np.savez(sys.argv[4], energy=at.calc.results['energy'], forces=at.calc.results['forces'],
+         virial=at.calc.extra_results['config']['virial'])
+"""
+
+    LJ_str = """<LJ_params n_types="1" label="default">
+    <!-- dummy paramters for testing purposes, no physical meaning -->
+    <per_type_data type="1" atomic_num="14" />
+    <per_pair_data type1="1" type2="1" sigma="2.0" eps6="1.0" eps12="1.0" cutoff="5.0" energy_shift="T" linear_force_shift="F" />
+    </LJ_params>
+    """
+
+    Coulomb_str = """<Coulomb_params n_types="1" cutoff="6.0" method="{method}" dsf_alpha="0.2" label="default">
+    <per_type_data type="1" atomic_num="14" charge="0.5" />
+    </Coulomb_params>
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.parameters = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'share', 'Parameters')
+
+        self.at_file = os.path.join(self.tmpdir.name, 'at.xyz')
+        at = ase.build.bulk('Si', 'diamond', a=5.44, cubic=True) * (2, 2, 2)
+        at.rattle(0.1, seed=1)
+        at.write(self.at_file)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def calc(self, args_str, param_filename, n_threads):
+        out_file = os.path.join(self.tmpdir.name, 'results_{}.npz'.format(n_threads))
+        env = os.environ.copy()
+        env['OMP_NUM_THREADS'] = str(n_threads)
+        subprocess.run([sys.executable, '-c', self.script, args_str, param_filename, self.at_file, out_file],
+                       env=env, check=True)
+        return np.load(out_file)
+
+    def check_threads(self, args_str, param_filename):
+        ref = self.calc(args_str, param_filename, 1)
+        for n_threads in [2, 4]:
+            res = self.calc(args_str, param_filename, n_threads)
+            self.assertAlmostEqual(float(res['energy']), float(ref['energy']), delta=1e-8)
+            self.assertArrayAlmostEqual(res['forces'], ref['forces'], tol=1e-8)
+            self.assertArrayAlmostEqual(res['virial'], ref['virial'], tol=1e-8)
+
+    def test_lj(self):
+        param_filename = os.path.join(self.tmpdir.name, 'LJ.xml')
+        with open(param_filename, 'w') as f:
+            f.write(self.LJ_str)
+        self.check_threads('IP LJ', param_filename)
+
+    def test_tersoff(self):
+        self.check_threads('IP Tersoff', os.path.join(self.parameters, 'ip.parms.Tersoff.xml'))
+
+    def test_si_meam(self):
+        self.check_threads('IP Si_MEAM', os.path.join(self.parameters, 'ip.parms.Si_MEAM.xml'))
+
+    def check_coulomb_threads(self, method):
+        param_filename = os.path.join(self.tmpdir.name, 'Coulomb.xml')
+        with open(param_filename, 'w') as f:
+            f.write(self.Coulomb_str.format(method=method))
+        self.check_threads('IP Coulomb', param_filename)
+
+    def test_coulomb_direct(self):
+        self.check_coulomb_threads('Direct')
+
+    def test_coulomb_dsf(self):
+        self.check_coulomb_threads('DSF')
+
+
+class TestCalculator_Coulomb_PME(quippytest.QuippyTestCase):
+
+    xml = """<Coulomb_params n_types="2" cutoff="7.0" method="{method}" ewald_error="{ewald_error}" label="default">
+    <per_type_data type="1" atomic_num="11" charge="1.0" />
+    <per_type_data type="2" atomic_num="17" charge="-1.0" />
+    </Coulomb_params>"""
+
+    def setUp(self):
+        self.at = ase.build.bulk('NaCl', 'rocksalt', a=5.64, cubic=True) * (2, 2, 2)
+        self.at.rattle(0.05, seed=1)
+        self.at.set_cell(self.at.cell + [[0.0, 0.0, 0.0], [0.4, 0.0, 0.0], [0.0, -0.3, 0.0]], scale_atoms=True)
+
+        self.ewald = Potential('IP Coulomb', param_str=self.xml.format(method='Ewald', ewald_error=1e-10))
+        self.pme = Potential('IP Coulomb', param_str=self.xml.format(method='PME', ewald_error=1e-6))
+
+    def calc(self, pot):
+        at = self.at.copy()
+        at.calc = pot
+        return at.get_potential_energy(), at.get_forces(), at.get_stress()
+
+    def test_pme_matches_ewald(self):
+        e_ewald, f_ewald, s_ewald = self.calc(self.ewald)
+        e_pme, f_pme, s_pme = self.calc(self.pme)
+        self.assertAlmostEqual(e_pme, e_ewald, delta=5e-5)
+        self.assertArrayAlmostEqual(s_pme, s_ewald, tol=1e-6)
+        # ewald_error is the target RMS force error, real and reciprocal space together
+        rms_force_error = np.sqrt(np.sum((f_pme - f_ewald)**2) / len(self.at))
+        self.assertLess(rms_force_error, 1e-6)
+
+
+class TestCalculator_Coulomb_Pairwise(quippytest.QuippyTestCase):
+    """
+    Direct_Coulomb_calc and DSF_Coulomb_calc skip the bond cosines and the potential
+    derivative when neither forces nor the virial are requested.
+    """
+
+    xml = """<Coulomb_params n_types="2" cutoff="6.0" method="{method}" dsf_alpha="0.2" label="default">
+    <per_type_data type="1" atomic_num="11" charge="1.0" />
+    <per_type_data type="2" atomic_num="17" charge="-1.0" />
+    </Coulomb_params>"""
+
+    def setUp(self):
+        self.at = ase.build.bulk('NaCl', 'rocksalt', a=5.64, cubic=True) * (2, 2, 2)
+        self.at.rattle(0.05, seed=1)
+
+    def calc(self, method, args_str):
+        pot = Potential('IP Coulomb', param_str=self.xml.format(method=method))
+        quip_atoms = quippy.convert.ase_to_quip(self.at)
+        energy = np.zeros(1)
+        pot._quip_potential.calc(quip_atoms, args_str=args_str, energy=energy)
+        return energy[0], quippy.convert.get_dict_arrays(quip_atoms.properties)
+
+    def check_energy_only(self, method, full_args_str):
+        e_only, props = self.calc(method, 'energy')
+        self.assertFalse('force' in props)
+        e_full, props = self.calc(method, full_args_str)
+        self.assertTrue('force' in props)
+        self.assertAlmostEqual(e_only, e_full, places=10)
+        return e_full, props
+
+    def test_direct_energy_only(self):
+        self.check_energy_only('Direct', 'energy force virial')
+
+    def test_dsf_energy_only(self):
+        e_full, props = self.check_energy_only('DSF', 'energy force virial local_energy')
+        self.assertAlmostEqual(np.sum(props['local_energy']), e_full, places=10)
+
+
+class TestCalculator_Coulomb_Ewald_Tune(quippytest.QuippyTestCase):
+
+    xml = """<Coulomb_params n_types="2" cutoff="6.0" method="Ewald" ewald_error="{ewald_error}" ewald_tune="{tune}" label="default">
+    <per_type_data type="1" atomic_num="11" charge="1.0" />
+    <per_type_data type="2" atomic_num="17" charge="-1.0" />
+    </Coulomb_params>"""
+
+    def setUp(self):
+        self.at = ase.build.bulk('NaCl', 'rocksalt', a=5.64, cubic=True) * (2, 2, 2)
+        self.at.rattle(0.05, seed=1)
+
+        self.ewald = Potential('IP Coulomb', param_str=self.xml.format(ewald_error=1e-10, tune='F'))
+        self.tuned = Potential('IP Coulomb', param_str=self.xml.format(ewald_error=1e-6, tune='T'))
+
+    def calc(self, pot, at):
+        at = at.copy()
+        at.calc = pot
+        return at.get_potential_energy(), at.get_forces(), at.get_stress()
+
+    def test_tuned_matches_ewald(self):
+        strained = self.at.copy()
+        strained.set_cell(self.at.cell * 1.1, scale_atoms=True)
+        # the second call reuses the tuning, the strained cell triggers a retune
+        for at in [self.at, self.at, strained]:
+            e_ewald, f_ewald, s_ewald = self.calc(self.ewald, at)
+            e_tuned, f_tuned, s_tuned = self.calc(self.tuned, at)
+            self.assertAlmostEqual(e_tuned, e_ewald, delta=1e-3)
+            self.assertArrayAlmostEqual(f_tuned, f_ewald, tol=1e-4)
+            self.assertArrayAlmostEqual(s_tuned, s_ewald, tol=1e-5)
+
+    # Ewald_tune reports each tuning at PRINT_VERBOSE. The Fortran output goes to the
+    # process stdout, so the calculations run in a separate process.
+    retune_script = """
+import sys
+import ase.build
+import quippy
+from quippy.potential import Potential
+quippy.system_module.verbosity_push(int(sys.argv[2]))
+pot = Potential('IP Coulomb', param_str=sys.argv[1])
+at0 = ase.build.bulk('NaCl', 'rocksalt', a=5.64, cubic=True) * (2, 2, 2)
+at0.rattle(0.05, seed=1)
+for strain in sys.argv[3:]:
+    at = at0.copy()
+    at.set_cell(at0.cell * float(strain), scale_atoms=True)
+    at.calc = pot
+    at.get_potential_energy()
+"""
+
+    def tunings(self, strains, verbosity=quippy.system_module.PRINT_VERBOSE):
+        out = subprocess.run([sys.executable, '-c', self.retune_script, self.xml.format(ewald_error=1e-6, tune='T'),
+                              str(verbosity)] + [str(strain) for strain in strains],
+                             check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+        # the tuned real space cutoff of each tuning
+        return [float(line.split()[6]) for line in out.splitlines() if line.startswith('Ewald_tune: alpha')]
+
+    def test_retune(self):
+        # the default ewald_retune_tolerance is 0.05, relative to the tuned cell
+        self.assertEqual(len(self.tunings([1.0, 1.0, 1.02, 0.98])), 1)
+        self.assertEqual(len(self.tunings([1.0, 1.1])), 2)
+        self.assertEqual(len(self.tunings([1.0, 1.02, 1.1, 1.12, 1.0])), 3)
+        # silent at the default verbosity
+        self.assertEqual(len(self.tunings([1.0, 1.1], verbosity=quippy.system_module.PRINT_NORMAL)), 0)
+
+    def test_cutoff_capped(self):
+        # without the cap the balanced cutoff of these cells is about 11 A
+        cutoffs = self.tunings([1.0, 1.5])
+        self.assertEqual(len(cutoffs), 2)
+        for cutoff in cutoffs:
+            self.assertLessEqual(cutoff, 6.0)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,90 @@
+# HQ XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX
+# HQ X
+# HQ X   quippy: Python interface to QUIP atomistic simulation library
+# HQ X
+# HQ X   Copyright James Kermode 2020
+# HQ X
+# HQ X   These portions of the source code are released under the GNU General
+# HQ X   Public License, version 2, http://www.gnu.org/copyleft/gpl.html
+# HQ X
+# HQ X   If you would like to license the source code under different terms,
+# HQ X   please contact James Kermode, james.kermode@gmail.com
+# HQ X
+# HQ X   When using this software, please cite the following reference:
+# HQ X
+# HQ X   http://www.jrkermode.co.uk/quippy
+# HQ X
+# HQ XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX
+
+import unittest
+
+import numpy as np
+import quippy
+import quippytest
+from quippy.spline_module import Spline
+
+
+def f(x):
+    return 1.0 - 2.0 * x + 0.5 * x ** 2 + 0.3 * x ** 3
+
+
+def df(x):
+    return -2.0 + x + 0.9 * x ** 2
+
+
+class TestSpline(quippytest.QuippyTestCase):
+    """
+    A cubic spline with the exact end derivatives reproduces a cubic polynomial, so the
+    interpolation can be checked against it on non-uniform, uniform and resampled knots.
+    """
+
+    def setUp(self):
+        rng = np.random.RandomState(1)
+        self.x0, self.xn = 0.5, 3.0
+        self.x_nonuniform = np.concatenate([[self.x0], np.sort(rng.uniform(self.x0, self.xn, 15)), [self.xn]])
+        self.x_uniform = np.linspace(self.x0, self.xn, 17)
+
+        # random points, points in the first and last intervals and the end knots
+        self.points = np.concatenate([rng.uniform(self.x0, self.xn, 200),
+                                      self.x0 + 1e-3 * rng.uniform(size=5),
+                                      self.xn - 1e-3 * rng.uniform(size=5),
+                                      [self.x0, self.xn]])
+
+    def make_spline(self, x, n_uniform=None):
+        spline = Spline()
+        spline.init(x, f(x), df(self.x0), df(self.xn), n_uniform=n_uniform)
+        return spline
+
+    def check_spline(self, spline):
+        value = np.array([spline.value(p) for p in self.points])
+        deriv = np.array([spline.deriv(p) for p in self.points])
+        self.assertArrayAlmostEqual(value, f(self.points), tol=1e-10)
+        self.assertArrayAlmostEqual(deriv, df(self.points), tol=1e-10)
+
+        value_array = np.zeros(len(self.points))
+        deriv_array = np.zeros(len(self.points))
+        spline.value_array(self.points, value_array)
+        spline.deriv_array(self.points, deriv_array)
+        self.assertArrayAlmostEqual(value_array, value, tol=1e-14)
+        self.assertArrayAlmostEqual(deriv_array, deriv, tol=1e-14)
+
+    def test_nonuniform(self):
+        spline = self.make_spline(self.x_nonuniform)
+        self.assertFalse(spline.uniform)
+        self.check_spline(spline)
+
+    def test_uniform(self):
+        spline = self.make_spline(self.x_uniform)
+        self.assertTrue(spline.uniform)
+        self.check_spline(spline)
+
+    def test_n_uniform(self):
+        spline = self.make_spline(self.x_nonuniform, n_uniform=40)
+        self.assertTrue(spline.uniform)
+        self.assertEqual(spline.n, 40)
+        self.assertArrayAlmostEqual(spline.x, np.linspace(self.x0, self.xn, 40), tol=1e-14)
+        self.check_spline(spline)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -18,8 +18,14 @@
 
 import unittest
 import os
+import subprocess
+import sys
+import tempfile
 
+import ase
 import ase.build
+import ase.io
+import numpy as np
 import quippy
 import quippytest
 
@@ -63,5 +69,75 @@ class TestCalculatorSumPotential(quippytest.QuippyTestCase):
         self.assertArrayAlmostEqual(*self.calcboth("energies"), tol=1E-06)
 
 
+class TestCalculatorSumPotential_SW(quippytest.QuippyTestCase):
+    """
+    A sum nests Potential_Calc and Potential_Simple_Calc, whose frames only just fit in the default 8 MB
+    stack, so each calculation runs in a separate process, where the Python stack above them is shallow.
+    """
+
+    script = """
+import sys
+import ase.build
+import numpy as np
+from quippy.potential import Potential
+at = ase.build.bulk('Si', 'diamond', 5.43) * (2, 2, 2)
+at.rattle(0.05, seed=1)
+pot1 = Potential('IP SW', param_filename='SW_pot.xml')
+pot2 = Potential('IP SW', param_filename='SW_pot.xml')
+at.calc = pot1 if sys.argv[1] == 'single' else Potential(args_str='Potential Sum', pot1=pot1, pot2=pot2)
+np.savez(sys.argv[2], energy=at.get_potential_energy(), forces=at.get_forces(), stress=at.get_stress())
+"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def calc(self, which):
+        out_file = os.path.join(self.tmpdir.name, which + '.npz')
+        subprocess.run([sys.executable, '-c', self.script, which, out_file], check=True,
+                       cwd=os.path.dirname(os.path.abspath(__file__)))
+        return np.load(out_file)
+
+    def test_sum(self):
+        results = self.calc('sum')
+        ref = self.calc('single')
+        for key in ['energy', 'forces', 'stress']:
+            self.assertArrayAlmostEqual(results[key], 2 * ref[key], tol=1e-8)
+
+
+@unittest.skipIf(os.environ['HAVE_GAP'] != '1', 'GAP support not enabled')
+class TestCalculatorSumPotential_GAP(quippytest.QuippyTestCase):
+    """
+    The GAP models of a sum compute the descriptors they have in common once
+    """
+
+    def setUp(self):
+        self.pot1 = quippy.potential.Potential("IP GAP", param_filename="GAP.xml")
+        self.pot2 = quippy.potential.Potential("IP GAP", param_filename="GAP.xml")
+        self.sumpot = quippy.potential.Potential(args_str="Potential Sum", pot1=self.pot1, pot2=self.pot2)
+
+        at_orig = ase.io.read('gap_sample.xyz')
+        self.at = ase.Atoms(numbers=at_orig.arrays['numbers'], positions=at_orig.get_positions(), pbc=True,
+                            cell=at_orig.get_cell())
+
+    def calc(self, pot):
+        pot.calculate(self.at.copy(), properties=['energy', 'forces', 'stress', 'stresses'])
+        return pot.results['energy'], pot.results['forces'], pot.extra_results['config']['virial'], \
+            pot.extra_results['atoms']['local_virial']
+
+    def assertSumOf(self, sum_results, *results):
+        for i, result in enumerate(sum_results):
+            self.assertArrayAlmostEqual(result, sum(r[i] for r in results), tol=1e-8 * max(np.abs(result).max(), 1.0))
+
+    def test_sum(self):
+        results1 = self.calc(self.pot1)
+        results2 = self.calc(self.pot2)
+        self.assertSumOf(self.calc(self.sumpot), results1, results2)
+        # the shared descriptors are freed at the end of each calculation
+        self.assertSumOf(self.calc(self.sumpot), results1, results2)
+
+
 if __name__ == '__main__':
     unittest.main()